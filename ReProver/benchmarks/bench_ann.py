@@ -0,0 +1,142 @@
+"""Benchmark recall and latency of ``IVFIndex`` against exact nearest premise search.
+
+Premise embeddings are drawn around random cluster centers, and each query is a noisy
+mixture of 1-3 accessible "gold" premises. Recall@K and MRR are defined as in
+``PremiseRetriever.validation_step``.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_ann.py --num-files 2000 --nlist 256 --nprobe 4 8 16 32
+"""
+
+import time
+import torch
+import random
+import argparse
+import tempfile
+import numpy as np
+import torch.nn.functional as F
+from loguru import logger
+from typing import List, Tuple
+
+from common import Corpus, Context, IVFIndex, Premise
+from synthetic import resolve_corpus_path
+from bench_nearest_premises import sample_contexts
+
+
+def recall_and_mrr(
+    retrieved: List[List[Premise]], gold: List[List[Premise]], k: int
+) -> Tuple[float, float]:
+    """Return Recall@k (in %) and MRR as in ``PremiseRetriever.validation_step``."""
+    recall = []
+    mrr = []
+    for premises, pos_premises in zip(retrieved, gold):
+        pos_premises = set(pos_premises)
+        recall.append(len(pos_premises.intersection(premises[:k])) / len(pos_premises))
+        ranks = [j for j, p in enumerate(premises) if p in pos_premises]
+        mrr.append(1.0 / (ranks[0] + 1) if ranks != [] else 0.0)
+    return 100 * np.mean(recall), np.mean(mrr)
+
+
+def make_queries(
+    corpus: Corpus, embeddings: torch.FloatTensor, contexts: List[Context], noise: float
+) -> Tuple[torch.FloatTensor, List[List[Premise]]]:
+    query_embs = []
+    gold = []
+    for ctx in contexts:
+        accessible = corpus.get_accessible_premise_indexes(ctx.path, ctx.theorem_pos)
+        idxs = random.sample(accessible, random.randint(1, 3))
+        gold.append([corpus[i] for i in idxs])
+        query_embs.append(
+            embeddings[idxs].mean(dim=0) + noise * torch.randn(embeddings.size(1))
+        )
+    return F.normalize(torch.stack(query_embs), dim=1), gold
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark IVF approximate search against exact search."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=2000)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=1472)
+    parser.add_argument("--num-clusters", type=int, default=1024)
+    parser.add_argument("--noise", type=float, default=0.03)
+    parser.add_argument("--num-queries", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+    torch.manual_seed(0)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus = Corpus(
+            resolve_corpus_path(
+                args.corpus_path, dirname, args.num_files, args.premises_per_file
+            )
+        )
+    centers = F.normalize(torch.randn(args.num_clusters, args.dim), dim=1)
+    embeddings = F.normalize(
+        centers[torch.randint(args.num_clusters, (len(corpus),))]
+        + 0.02 * torch.randn(len(corpus), args.dim),
+        dim=1,
+    )
+    contexts = sample_contexts(corpus, args.num_queries, args.k)
+    query_embs, gold = make_queries(corpus, embeddings, contexts, args.noise)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(embeddings, args.nlist)
+    print(
+        f"{len(corpus)} premises, IVF build with nlist = {args.nlist}: {time.perf_counter() - start:.2f} s"
+    )
+
+    def run(search) -> Tuple[List[List[Premise]], float]:
+        retrieved = []
+        start = time.perf_counter()
+        for i in range(0, len(contexts), args.batch_size):
+            premises, _ = search(
+                contexts[i : i + args.batch_size],
+                query_embs[i : i + args.batch_size],
+            )
+            retrieved.extend(premises)
+        return retrieved, 1000 * (time.perf_counter() - start) / len(contexts)
+
+    exact, t_exact = run(
+        lambda ctxs, embs: corpus.get_nearest_premises(embeddings, ctxs, embs, args.k)
+    )
+    print(
+        f"{'search':>12} {'ms/query':>9} {'R@1':>6} {'R@10':>6} {'MRR':>6} {'overlap@k':>10}"
+    )
+    r1, mrr = recall_and_mrr(exact, gold, 1)
+    r10, _ = recall_and_mrr(exact, gold, 10)
+    print(
+        f"{'exact':>12} {t_exact:>9.2f} {r1:>6.1f} {r10:>6.1f} {mrr:>6.3f} {100.0:>10.1f}"
+    )
+
+    for nprobe in args.nprobe:
+        approx, t = run(
+            lambda ctxs, embs: index.search(
+                corpus, embeddings, ctxs, embs, args.k, nprobe
+            )
+        )
+        r1, mrr = recall_and_mrr(approx, gold, 1)
+        r10, _ = recall_and_mrr(approx, gold, 10)
+        overlap = np.mean(
+            [100 * len(set(a) & set(e)) / args.k for a, e in zip(approx, exact)]
+        )
+        print(
+            f"{f'nprobe={nprobe}':>12} {t:>9.2f} {r1:>6.1f} {r10:>6.1f} {mrr:>6.3f} {overlap:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
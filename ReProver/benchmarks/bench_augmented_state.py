@@ -0,0 +1,110 @@
+"""Benchmark ``format_augmented_state`` against the previous implementation, which
+serialized and encoded every premise on each call and prepended them one by one.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_augmented_state.py --corpus-path data/leandojo_benchmark_4/corpus.jsonl
+"""
+
+import json
+import time
+import random
+import argparse
+import tempfile
+from loguru import logger
+from typing import List, Optional
+
+from common import (
+    File,
+    Premise,
+    PremiseTable,
+    format_augmented_states,
+    _serialize_premise,
+)
+from synthetic import resolve_corpus_path
+
+
+def legacy_format_augmented_state(
+    s: str, premises: List[Premise], max_len: Optional[int] = None, p_drop: float = 0.0
+) -> str:
+    """Reference implementation: the previous ``format_augmented_state``."""
+    aug_s = ""
+    length = 0
+    if max_len is None:
+        max_len = 9999999999999999999999
+    max_premises_len = max_len - len(bytes(s.encode("utf-8")))
+
+    for p in premises:
+        if random.random() < p_drop:
+            continue
+        p_str = f"{_serialize_premise(p.full_name, p.code)}\n\n"
+        l = len(bytes(p_str.encode("utf-8")))
+        if length + l > max_premises_len:
+            continue
+        length += l
+        aug_s = p_str + aug_s
+
+    aug_s += s
+    return aug_s
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark format_augmented_state.")
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=400)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--num-states", type=int, default=2000)
+    parser.add_argument("--num-retrieved", type=int, default=100)
+    parser.add_argument("--max-len", type=int, default=2048)
+    parser.add_argument("--p-drop", type=float, default=0.5)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus_path = resolve_corpus_path(
+            args.corpus_path, dirname, args.num_files, args.premises_per_file
+        )
+        files = [File.from_data(json.loads(line)) for line in open(corpus_path)]
+    table = PremiseTable.from_files(files)
+
+    states = [
+        f"a b : ℕ\nh : a ≤ b\n⊢ a + {i} = {i} + a" for i in range(args.num_states)
+    ]
+    # Retrieved premises are views over the table, as returned by the retriever.
+    retrieved = [
+        [table[random.randrange(len(table))] for _ in range(args.num_retrieved)]
+        for _ in states
+    ]
+
+    for max_len in (args.max_len, None):
+        random.seed(1)
+        expected = [
+            legacy_format_augmented_state(s, ps, max_len, args.p_drop)
+            for s, ps in zip(states, retrieved)
+        ]
+        random.seed(1)
+        assert (
+            format_augmented_states(states, retrieved, max_len, args.p_drop) == expected
+        )
+
+    start = time.perf_counter()
+    for s, ps in zip(states, retrieved):
+        legacy_format_augmented_state(s, ps, args.max_len, args.p_drop)
+    t_legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    format_augmented_states(states, retrieved, args.max_len, args.p_drop)
+    t_new = time.perf_counter() - start
+
+    print(f"{len(states)} states, {args.num_retrieved} premises each, us per state:")
+    print(f"previous: {1e6 * t_legacy / len(states):.1f}")
+    print(f"current: {1e6 * t_new / len(states):.1f} ({t_legacy / t_new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark ``PremiseRetriever.retrieve_batch`` against repeated ``retrieve`` calls.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_batch_retrieval.py --ckpt-path kaiyuy/leandojo-lean4-retriever-byt5-small
+"""
+
+import time
+import torch
+import random
+import argparse
+import tempfile
+import torch.nn.functional as F
+from loguru import logger
+from lean_dojo import Pos
+from typing import List, Tuple
+
+from common import Corpus
+from synthetic import resolve_corpus_path
+from retrieval.model import PremiseRetriever
+
+
+def sample_queries(
+    corpus: Corpus, num_queries: int, k: int
+) -> List[Tuple[str, str, str, Pos]]:
+    """Sample proof states at the end of files that can see at least ``k`` premises."""
+    candidates = []
+    for path in corpus.premise_ranges:
+        premises = corpus.get_premises(path)
+        if premises == []:
+            continue
+        pos = premises[-1].end
+        if corpus.get_accessible_premise_mask(path, pos).sum() >= k:
+            candidates.append((path, premises[-1].full_name, pos))
+
+    queries = []
+    for path, full_name, pos in random.choices(candidates, k=num_queries):
+        hyps = "\n".join(f"h{i} : a + {i} ≤ b" for i in range(random.randint(0, 8)))
+        state = f"a b : ℕ\n{hyps}\n⊢ a + b = b + a"
+        queries.append((state, path, full_name, pos))
+    return queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark batched premise retrieval throughput."
+    )
+    parser.add_argument("--ckpt-path", type=str, required=True)
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=1000)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--num-queries", type=int, default=256)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--k", type=int, default=100)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus = Corpus(
+            resolve_corpus_path(
+                args.corpus_path, dirname, args.num_files, args.premises_per_file
+            )
+        )
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = PremiseRetriever.load_hf(args.ckpt_path, 2048, device)
+    model.load_corpus(corpus)
+    # Random unit vectors are enough to measure throughput and skip indexing.
+    model.corpus_embeddings = F.normalize(
+        torch.randn(len(corpus), model.embedding_size), dim=1
+    )
+    model.embeddings_staled = False
+    queries = sample_queries(corpus, args.num_queries, args.k)
+
+    start = time.perf_counter()
+    single = [model.retrieve(*q, args.k) for q in queries]
+    t_single = time.perf_counter() - start
+    print(f"{len(corpus)} premises, {len(queries)} queries, k = {args.k}")
+    print(f"retrieve:           {len(queries) / t_single:8.1f} queries/s")
+
+    for batch_size in args.batch_sizes:
+        premises, scores = [], []
+        start = time.perf_counter()
+        for i in range(0, len(queries), batch_size):
+            p, s = model.retrieve_batch(queries[i : i + batch_size], args.k)
+            premises.extend(p)
+            scores.extend(s)
+        t = time.perf_counter() - start
+        # Padding changes context embeddings by float rounding only.
+        same = sum(p == r[0] for p, r in zip(premises, single))
+        max_diff = max(
+            abs(x - y) for s, r in zip(scores, single) for x, y in zip(s, r[1])
+        )
+        print(
+            f"retrieve_batch({batch_size:>3}): {len(queries) / t:8.1f} queries/s "
+            f"({t_single / t:.1f}x), identical rankings: {same}/{len(queries)}, "
+            f"max score diff: {max_diff:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Benchmark constructing a ``Corpus`` from ``corpus.jsonl`` against loading a snapshot,
+memory-mapped or into memory.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_corpus_startup.py --corpus-path data/leandojo_benchmark_4/corpus.jsonl
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from loguru import logger
+
+from common import Corpus
+from synthetic import resolve_corpus_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark Corpus startup from JSONL and from a snapshot."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=2000)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    args = parser.parse_args()
+    logger.info(args)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus_path = resolve_corpus_path(
+            args.corpus_path, dirname, args.num_files, args.premises_per_file
+        )
+
+        start = time.perf_counter()
+        corpus = Corpus(corpus_path)
+        t_jsonl = time.perf_counter() - start
+
+        snapshot_dir = os.path.join(dirname, "snapshot")
+        corpus.save_snapshot(snapshot_dir)
+        size = sum(
+            os.path.getsize(os.path.join(snapshot_dir, f))
+            for f in os.listdir(snapshot_dir)
+        )
+
+        start = time.perf_counter()
+        loaded = Corpus.load_snapshot(snapshot_dir)
+        t_snapshot = time.perf_counter() - start
+
+        start = time.perf_counter()
+        in_memory = Corpus.load_snapshot(snapshot_dir, mmap=False)
+        t_in_memory = time.perf_counter() - start
+
+        assert list(loaded.all_premises) == list(corpus.all_premises)
+        assert list(in_memory.all_premises) == list(corpus.all_premises)
+        assert np.array_equal(
+            loaded.transitive_dep_graph.bits, corpus.transitive_dep_graph.bits
+        )
+
+    print(f"files: {corpus.num_files}, premises: {len(corpus)}")
+    print(f"snapshot size: {size / 2**20:.1f} MiB")
+    print(f"Corpus(jsonl):        {t_jsonl:.3f} s")
+    print(f"Corpus.load_snapshot: {t_snapshot:.3f} s ({t_jsonl / t_snapshot:.1f}x)")
+    print(f"  with mmap=False:    {t_in_memory:.3f} s ({t_jsonl / t_in_memory:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
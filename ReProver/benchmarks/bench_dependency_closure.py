@@ -0,0 +1,103 @@
+"""Benchmark the bit-matrix ``DependencyClosure`` against ``networkx.transitive_closure_dag``.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_dependency_closure.py --corpus-path data/leandojo_benchmark_4/corpus.jsonl
+"""
+
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import networkx as nx
+from loguru import logger
+from typing import Any, Callable, Dict, List, Tuple
+
+from common import DependencyClosure
+from synthetic import resolve_corpus_path
+
+
+def load_imports(corpus_path: str) -> Dict[str, List[str]]:
+    imports = {}
+    for line in open(corpus_path):
+        file_data = json.loads(line)
+        imports[file_data["path"]] = file_data["imports"]
+    return imports
+
+
+def networkx_closure(imports: Dict[str, List[str]]) -> nx.DiGraph:
+    """Reference implementation previously used by :class:`Corpus`."""
+    dep_graph = nx.DiGraph()
+    for path, deps in imports.items():
+        dep_graph.add_node(path)
+        for p in deps:
+            dep_graph.add_edge(path, p)
+    assert nx.is_directed_acyclic_graph(dep_graph)
+    return nx.transitive_closure_dag(dep_graph)
+
+
+def measure(fn: Callable[[], Any]) -> Tuple[float, float, Any]:
+    """Return the wall time, peak traced memory (MiB) and output of ``fn``."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20, out
+
+
+def timeit(fn: Callable[[], Any], repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark reachability structures for the file dependency graph."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=3000)
+    parser.add_argument("--num-queries", type=int, default=100000)
+    args = parser.parse_args()
+    logger.info(args)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        imports = load_imports(
+            resolve_corpus_path(args.corpus_path, dirname, args.num_files, 1)
+        )
+
+    t_nx, mem_nx, graph = measure(lambda: networkx_closure(imports))
+    t_bits, mem_bits, closure = measure(lambda: DependencyClosure.from_imports(imports))
+
+    paths = closure.nodes
+    for path in paths:
+        assert set(graph.successors(path)) == set(closure.successors(path))
+
+    random.seed(0)
+    queries = [
+        (random.choice(paths), random.choice(paths)) for _ in range(args.num_queries)
+    ]
+    q_nx = timeit(lambda: [graph.has_edge(u, v) for u, v in queries], 1)
+    q_bits = timeit(lambda: [closure.has_edge(u, v) for u, v in queries], 1)
+
+    print(f"files: {len(paths)}, closure edges: {graph.number_of_edges()}")
+    print(f"{'':>18} {'build (s)':>10} {'peak (MiB)':>11} {'has_edge (us)':>14}")
+    for name, t, mem, q in [
+        ("networkx", t_nx, mem_nx, q_nx),
+        ("DependencyClosure", t_bits, mem_bits, q_bits),
+    ]:
+        print(f"{name:>18} {t:>10.3f} {mem:>11.1f} {1e6 * q / len(queries):>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
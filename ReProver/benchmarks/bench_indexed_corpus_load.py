@@ -0,0 +1,134 @@
+"""Benchmark opening an ``IndexedCorpus`` from a pickle against the directory format.
+
+Each load runs in a fresh process, which reports its load time, the time of its first
+nearest premise search, and its private (unshared) resident memory. Several processes
+opening the same directory share the embeddings and premises through the page cache.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_indexed_corpus_load.py --num-files 2000 --num-procs 2
+"""
+
+import os
+import time
+import torch
+import pickle
+import argparse
+import tempfile
+import multiprocessing as mp
+import torch.nn.functional as F
+from loguru import logger
+from typing import Tuple
+
+from common import Context, Corpus, IndexedCorpus
+from synthetic import resolve_corpus_path
+
+
+def _private_mib() -> float:
+    with open("/proc/self/smaps_rollup") as inp:
+        return (
+            sum(
+                int(line.split()[1])
+                for line in inp
+                if line.startswith(("Private_Clean", "Private_Dirty"))
+            )
+            / 1024
+        )
+
+
+def _load(path: str, ready, go) -> Tuple[float, float, float]:
+    before = _private_mib()
+    start = time.perf_counter()
+    if os.path.isdir(path):
+        indexed_corpus = IndexedCorpus.load(path)
+    else:
+        with open(path, "rb") as inp:
+            indexed_corpus = pickle.load(inp)
+    t_load = time.perf_counter() - start
+
+    corpus = indexed_corpus.corpus
+    p = corpus[len(corpus) - 1]
+    ctx_emb = F.normalize(torch.randn(1, indexed_corpus.embeddings.size(1)), dim=1)
+    start = time.perf_counter()
+    corpus.get_nearest_premises(
+        indexed_corpus.embeddings,
+        [Context(p.path, p.full_name, p.end, "⊢ True")],
+        ctx_emb,
+        10,
+    )
+    t_search = time.perf_counter() - start
+
+    # Measure memory while all processes hold the corpus.
+    ready.wait()
+    go.wait()
+    return t_load, t_search, _private_mib() - before
+
+
+def _worker(path: str, ready, go, queue) -> None:
+    queue.put(_load(path, ready, go))
+
+
+def run(path: str, num_procs: int) -> Tuple[float, float, float]:
+    ctx = mp.get_context("spawn")
+    ready = ctx.Barrier(num_procs + 1)
+    go = ctx.Barrier(num_procs + 1)
+    queue = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker, args=(path, ready, go, queue))
+        for _ in range(num_procs)
+    ]
+    for proc in procs:
+        proc.start()
+    ready.wait()
+    go.wait()
+    results = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    t_load, t_search, private = zip(*results)
+    return max(t_load), max(t_search), sum(private)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading a pickled IndexedCorpus against the directory format."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=2000)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=1472)
+    parser.add_argument("--num-procs", type=int, default=2)
+    args = parser.parse_args()
+    logger.info(args)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus = Corpus(
+            resolve_corpus_path(
+                args.corpus_path, dirname, args.num_files, args.premises_per_file
+            )
+        )
+        embeddings = F.normalize(torch.randn(len(corpus), args.dim), dim=1)
+        indexed_corpus = IndexedCorpus(corpus, embeddings)
+
+        pickle_path = os.path.join(dirname, "indexed_corpus.pickle")
+        with open(pickle_path, "wb") as oup:
+            pickle.dump(indexed_corpus, oup)
+        dir_path = os.path.join(dirname, "indexed_corpus")
+        indexed_corpus.save(dir_path)
+
+        print(f"{len(corpus)} premises, {args.dim}-dim float32 embeddings")
+        print(
+            f"{'format':>10} {'load (s)':>9} {'1st search (s)':>15} "
+            f"{f'private MiB x{args.num_procs}':>17}"
+        )
+        for name, path in [("pickle", pickle_path), ("directory", dir_path)]:
+            t_load, t_search, private = run(path, args.num_procs)
+            print(f"{name:>10} {t_load:>9.3f} {t_search:>15.3f} {private:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
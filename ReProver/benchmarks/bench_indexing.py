@@ -0,0 +1,96 @@
+"""Benchmark premise encoding throughput of ``PremiseRetriever.encode_premises``.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_indexing.py --ckpt-path kaiyuy/leandojo-lean4-retriever-byt5-small
+"""
+
+import time
+import torch
+import argparse
+import tempfile
+from tqdm import tqdm
+from loguru import logger
+from typing import List
+
+from common import Corpus, Premise
+from synthetic import resolve_corpus_path
+from retrieval.model import PremiseRetriever
+
+
+@torch.no_grad()
+def encode_in_corpus_order(
+    model: PremiseRetriever, premises: List[Premise], batch_size: int
+) -> torch.Tensor:
+    """Reference implementation: fixed-size batches in corpus order."""
+    embeddings = torch.zeros(
+        len(premises), model.embedding_size, dtype=model.encoder.dtype
+    )
+    for i in tqdm(range(0, len(premises), batch_size)):
+        tokenized_premises = model.tokenizer(
+            [p.serialize() for p in premises[i : i + batch_size]],
+            padding="longest",
+            max_length=model.max_seq_len,
+            truncation=True,
+            return_tensors="pt",
+        )
+        embeddings[i : i + batch_size] = model._encode(
+            tokenized_premises.input_ids, tokenized_premises.attention_mask
+        )
+    return embeddings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark premise encoding throughput on CPU."
+    )
+    parser.add_argument("--ckpt-path", type=str, required=True)
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=40)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--num-premises", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-tokens-per-batch", type=int, default=16384)
+    args = parser.parse_args()
+    logger.info(args)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus = Corpus(
+            resolve_corpus_path(
+                args.corpus_path, dirname, args.num_files, args.premises_per_file
+            )
+        )
+    premises = corpus.all_premises[: args.num_premises]
+    model = PremiseRetriever.load_hf(args.ckpt_path, 2048, torch.device("cpu"))
+
+    start = time.perf_counter()
+    ref = encode_in_corpus_order(model, premises, args.batch_size)
+    t_ref = time.perf_counter() - start
+    print(
+        f"corpus order, {args.batch_size} per batch: {len(premises) / t_ref:.1f} premises/s"
+    )
+
+    for max_tokens in [None, args.max_tokens_per_batch]:
+        start = time.perf_counter()
+        emb = model.encode_premises(
+            premises, args.batch_size, max_tokens_per_batch=max_tokens
+        )
+        t = time.perf_counter() - start
+        assert torch.allclose(emb.float(), ref.float(), atol=1e-3)
+        desc = (
+            f"{args.batch_size} per batch"
+            if max_tokens is None
+            else f"{max_tokens} tokens per batch"
+        )
+        print(
+            f"length-sorted, {desc}: {len(premises) / t:.1f} premises/s ({t_ref / t:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark ``Corpus.locate_premise`` and ``get_all_pos_premises``, the data preparation
+path of the retriever, against the previous linear scan over the premises of a file.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_locate_premise.py --corpus-path data/leandojo_benchmark_4/corpus.jsonl
+"""
+
+import time
+import random
+import argparse
+import tempfile
+from loguru import logger
+from lean_dojo import Pos
+from typing import Any, Dict, List, Optional, Tuple
+
+from common import Corpus, Premise, get_all_pos_premises
+from synthetic import resolve_corpus_path
+
+
+def legacy_locate_premise(corpus: Corpus, path: str, pos: Pos) -> Optional[Premise]:
+    """Reference implementation: the previous ``Corpus.locate_premise``."""
+    for p in corpus.get_premises(path):
+        if p.start <= pos <= p.end:
+            return p
+    return None
+
+
+def legacy_get_all_pos_premises(annot_tac, corpus: Corpus) -> List[Premise]:
+    _, provenances = annot_tac
+    all_pos_premises = set()
+    for prov in provenances:
+        p = legacy_locate_premise(corpus, prov["def_path"], Pos(*prov["def_pos"]))
+        if p is not None:
+            all_pos_premises.add(p)
+    return list(all_pos_premises)
+
+
+def make_annotated_tactics(
+    corpus: Corpus, num_tactics: int, max_provenances: int
+) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """Sample tactics whose provenances point at the start or inside of random premises."""
+    tactics = []
+    for _ in range(num_tactics):
+        provenances = []
+        for _ in range(random.randint(1, max_provenances)):
+            p = corpus.all_premises[random.randrange(len(corpus.all_premises))]
+            pos = random.choice([p.start, p.end, Pos(p.start.line_nb, 5)])
+            provenances.append(
+                {"def_path": p.path, "def_pos": [pos.line_nb, pos.column_nb]}
+            )
+        tactics.append(("", provenances))
+    return tactics
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark locate_premise and get_all_pos_premises."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=2000)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--num-tactics", type=int, default=20000)
+    parser.add_argument("--max-provenances", type=int, default=5)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus_path = resolve_corpus_path(
+            args.corpus_path, dirname, args.num_files, args.premises_per_file
+        )
+        corpus = Corpus(corpus_path)
+
+    # Positions between premises and past the end of files must not be located.
+    for path in random.sample(list(corpus.path2file), min(200, corpus.num_files)):
+        premises = corpus.get_premises(path)
+        last_line = premises[-1].end.line_nb if premises else 1
+        for line in range(1, last_line + 3):
+            for col in (1, 3, 19, 40):
+                pos = Pos(line, col)
+                assert corpus.locate_premise(path, pos) == legacy_locate_premise(
+                    corpus, path, pos
+                )
+
+    tactics = make_annotated_tactics(corpus, args.num_tactics, args.max_provenances)
+    num_provenances = sum(len(provs) for _, provs in tactics)
+
+    start = time.perf_counter()
+    expected = [set(legacy_get_all_pos_premises(tac, corpus)) for tac in tactics]
+    t_legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = [set(get_all_pos_premises(tac, corpus)) for tac in tactics]
+    t_indexed = time.perf_counter() - start
+    assert actual == expected
+
+    print(
+        f"{len(corpus.all_premises)} premises, {len(tactics)} tactics, {num_provenances} provenances"
+    )
+    print(f"linear scan: {1e6 * t_legacy / num_provenances:.2f} us/provenance")
+    print(
+        f"interval index: {1e6 * t_indexed / num_provenances:.2f} us/provenance ({t_legacy / t_indexed:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
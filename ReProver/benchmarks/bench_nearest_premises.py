@@ -0,0 +1,117 @@
+"""Benchmark ``Corpus.get_nearest_premises`` against the previous argsort-based search.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_nearest_premises.py --sizes 1000 10000 100000
+"""
+
+import time
+import torch
+import random
+import argparse
+import tempfile
+import torch.nn.functional as F
+from loguru import logger
+from typing import Any, List, Tuple
+
+from common import Corpus, Context, Premise
+from synthetic import make_synthetic_corpus
+
+
+def argsort_nearest_premises(
+    corpus: Corpus,
+    premise_embeddings: torch.FloatTensor,
+    batch_context: List[Context],
+    batch_context_emb: torch.Tensor,
+    k: int,
+) -> Tuple[List[List[Premise]], List[List[float]]]:
+    """Reference implementation: full argsort followed by a Python-level filter."""
+    similarities = batch_context_emb @ premise_embeddings.t()
+    idxs_batch = similarities.argsort(dim=1, descending=True).tolist()
+    results = [[] for _ in batch_context]
+    scores = [[] for _ in batch_context]
+
+    for j, (ctx, idxs) in enumerate(zip(batch_context, idxs_batch)):
+        accessible_premises = corpus.get_accessible_premises(ctx.path, ctx.theorem_pos)
+        for i in idxs:
+            p = corpus.all_premises[i]
+            if p in accessible_premises:
+                results[j].append(p)
+                scores[j].append(similarities[j, i].item())
+                if len(results[j]) >= k:
+                    break
+        else:
+            raise ValueError
+
+    return results, scores
+
+
+def sample_contexts(corpus: Corpus, num_contexts: int, k: int) -> List[Context]:
+    """Sample contexts located at the end of files that can see at least ``k`` premises."""
+    candidates = []
+    for path in corpus.premise_ranges:
+        premises = corpus.get_premises(path)
+        if premises == []:
+            continue
+        pos = premises[-1].end
+        if corpus.get_accessible_premise_mask(path, pos).sum() >= k:
+            candidates.append((path, premises[-1].full_name, pos))
+    return [
+        Context(path, full_name, pos, "a b : ℕ\n⊢ a + b = b + a")
+        for path, full_name, pos in random.choices(candidates, k=num_contexts)
+    ]
+
+
+def timeit(fn, repeats: int) -> Tuple[float, Any]:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn()
+    return (time.perf_counter() - start) / repeats, out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark masked top-k against argsort nearest premise search."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=1472)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+    torch.manual_seed(0)
+
+    print(f"{'premises':>10} {'argsort (s)':>12} {'topk (s)':>10} {'speedup':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as dirname:
+            num_files = max(1, size // args.premises_per_file)
+            corpus = Corpus(
+                make_synthetic_corpus(dirname, num_files, args.premises_per_file)
+            )
+
+        premise_embeddings = F.normalize(torch.randn(len(corpus), args.dim), dim=1)
+        contexts = sample_contexts(corpus, args.batch_size, args.k)
+        context_emb = F.normalize(torch.randn(len(contexts), args.dim), dim=1)
+
+        t_old, (old_premises, old_scores) = timeit(
+            lambda: argsort_nearest_premises(
+                corpus, premise_embeddings, contexts, context_emb, args.k
+            ),
+            args.repeats,
+        )
+        t_new, (new_premises, new_scores) = timeit(
+            lambda: corpus.get_nearest_premises(
+                premise_embeddings, contexts, context_emb, args.k
+            ),
+            args.repeats,
+        )
+        assert old_premises == new_premises
+        assert old_scores == new_scores
+        print(f"{len(corpus):>10} {t_old:>12.4f} {t_new:>10.4f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
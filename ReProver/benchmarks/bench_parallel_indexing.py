@@ -0,0 +1,108 @@
+"""Benchmark multi-process CPU indexing with ``ParallelPremiseEncoder``.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_parallel_indexing.py --ckpt-path kaiyuy/leandojo-lean4-retriever-byt5-small --workers 1 2 4 8
+"""
+
+import os
+import time
+import torch
+import argparse
+import tempfile
+from loguru import logger
+
+from common import Corpus
+from synthetic import resolve_corpus_path
+from retrieval.model import PremiseRetriever
+from retrieval.index import ParallelPremiseEncoder
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scaling of multi-process CPU indexing."
+    )
+    parser.add_argument("--ckpt-path", type=str, required=True)
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=40)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--num-premises", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-tokens-per-batch", type=int, default=None)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="Intra-op threads of each worker (default: #CPUs / #workers).",
+    )
+    args = parser.parse_args()
+    logger.info(args)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus = Corpus(
+            resolve_corpus_path(
+                args.corpus_path, dirname, args.num_files, args.premises_per_file
+            )
+        )
+    premises = corpus.all_premises[: args.num_premises]
+    model = PremiseRetriever.load_hf(args.ckpt_path, 2048, torch.device("cpu"))
+
+    start = time.perf_counter()
+    serial = model.encode_premises(
+        premises, args.batch_size, max_tokens_per_batch=args.max_tokens_per_batch
+    ).to(torch.float32)
+    t_serial = time.perf_counter() - start
+    print(f"{os.cpu_count()} CPUs, {len(premises)} premises")
+    print(
+        f"serial ({torch.get_num_threads()} threads): {len(premises) / t_serial:.1f} premises/s"
+    )
+
+    # Results can depend on the number of intra-op threads, so each worker count is
+    # checked against a serial run with as many threads as each worker.
+    references = {torch.get_num_threads(): serial}
+
+    def reference(num_threads: int) -> torch.Tensor:
+        if num_threads not in references:
+            default_threads = torch.get_num_threads()
+            torch.set_num_threads(num_threads)
+            references[num_threads] = model.encode_premises(
+                premises,
+                args.batch_size,
+                progress=False,
+                max_tokens_per_batch=args.max_tokens_per_batch,
+            ).to(torch.float32)
+            torch.set_num_threads(default_threads)
+        return references[num_threads]
+
+    for num_workers in args.workers:
+        threads = args.threads_per_worker or max(1, os.cpu_count() // num_workers)
+        with ParallelPremiseEncoder(
+            model, args.ckpt_path, num_workers, threads
+        ) as encoder:
+            # Exclude the one-off cost of spawning workers and loading the encoder.
+            encoder.encode_premises(premises[:num_workers], args.batch_size, False)
+            start = time.perf_counter()
+            embeddings = encoder.encode_premises(
+                premises,
+                args.batch_size,
+                max_tokens_per_batch=args.max_tokens_per_batch,
+            )
+            t = time.perf_counter() - start
+        identical = torch.equal(embeddings, reference(threads))
+        max_diff = (embeddings - serial).abs().max().item()
+        print(
+            f"{num_workers} workers x {threads} threads: "
+            f"{len(premises) / t:.1f} premises/s ({t_serial / t:.2f}x), "
+            f"identical to serial with {threads} threads: {identical}, "
+            f"max difference from serial with {torch.get_num_threads()} threads: {max_diff:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
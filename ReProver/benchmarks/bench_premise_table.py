@@ -0,0 +1,81 @@
+"""Benchmark the memory and access time of ``PremiseTable`` against a list of ``Premise`` objects.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_premise_table.py --corpus-path data/leandojo_benchmark_4/corpus.jsonl
+"""
+
+import gc
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from loguru import logger
+from typing import Any, Callable, Tuple
+
+from common import File, PremiseTable
+from synthetic import resolve_corpus_path
+
+
+def measure(build: Callable[[], Any]) -> Tuple[Any, float]:
+    """Return the result of ``build`` and the memory it retains in MiB."""
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size / 2**20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark PremiseTable against a list of Premise objects."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=2000)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--num-lookups", type=int, default=100000)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus_path = resolve_corpus_path(
+            args.corpus_path, dirname, args.num_files, args.premises_per_file
+        )
+        lines = open(corpus_path).readlines()
+
+    files, list_mib = measure(lambda: [File.from_data(json.loads(l)) for l in lines])
+    premises = [p for f in files for p in f.premises]
+    del files
+    table, table_mib = measure(
+        lambda: PremiseTable.from_files([File.from_data(json.loads(l)) for l in lines])
+    )
+    assert list(table) == premises
+
+    idxs = [random.randrange(len(premises)) for _ in range(args.num_lookups)]
+    start = time.perf_counter()
+    for i in idxs:
+        premises[i].full_name
+    t_list = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in idxs:
+        table[i].full_name
+    t_table = time.perf_counter() - start
+
+    print(f"{len(premises)} premises")
+    print(f"{'':>14} {'MiB':>8} {'us/lookup':>10}")
+    print(f"{'List[Premise]':>14} {list_mib:>8.1f} {1e6 * t_list / len(idxs):>10.2f}")
+    print(f"{'PremiseTable':>14} {table_mib:>8.1f} {1e6 * t_table / len(idxs):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark memory, latency and Recall@K of quantized premise embeddings.
+
+Premise embeddings and queries are generated as in ``bench_ann.py``. Each storage
+dtype in ``EMBEDDING_DTYPES`` is scored with ``Corpus.get_nearest_premises`` directly
+on the stored matrix, and compared with float32 by Recall@K, MRR and top-k overlap.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_quantization.py --num-files 2000 --k 100
+"""
+
+import time
+import torch
+import random
+import argparse
+import tempfile
+import numpy as np
+import torch.nn.functional as F
+from loguru import logger
+
+from common import Corpus, EMBEDDING_DTYPES, quantize_embeddings
+from synthetic import resolve_corpus_path
+from bench_nearest_premises import sample_contexts
+from bench_ann import recall_and_mrr, make_queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark quantized premise embeddings against float32."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=2000)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=1472)
+    parser.add_argument("--num-clusters", type=int, default=1024)
+    parser.add_argument("--spread", type=float, default=0.02)
+    parser.add_argument("--noise", type=float, default=0.03)
+    parser.add_argument("--num-queries", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=100)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+    torch.manual_seed(0)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus = Corpus(
+            resolve_corpus_path(
+                args.corpus_path, dirname, args.num_files, args.premises_per_file
+            )
+        )
+    centers = F.normalize(torch.randn(args.num_clusters, args.dim), dim=1)
+    embeddings = F.normalize(
+        centers[torch.randint(args.num_clusters, (len(corpus),))]
+        + args.spread * torch.randn(len(corpus), args.dim),
+        dim=1,
+    )
+    contexts = sample_contexts(corpus, args.num_queries, args.k)
+    query_embs, gold = make_queries(corpus, embeddings, contexts, args.noise)
+
+    print(
+        f"{len(corpus)} premises\n"
+        f"{'dtype':>8} {'MiB':>8} {'ms/query':>9} {'R@1':>6} {'R@10':>6} "
+        f"{'MRR':>6} {'overlap@k':>10}"
+    )
+    reference = None
+    for dtype in EMBEDDING_DTYPES:
+        values, scales = quantize_embeddings(embeddings, dtype)
+        mib = values.nbytes / 2**20
+        if scales is not None:
+            mib += scales.nbytes / 2**20
+
+        retrieved = []
+        start = time.perf_counter()
+        for i in range(0, len(contexts), args.batch_size):
+            premises, _ = corpus.get_nearest_premises(
+                values,
+                contexts[i : i + args.batch_size],
+                query_embs[i : i + args.batch_size],
+                args.k,
+                scales,
+            )
+            retrieved.extend(premises)
+        ms = 1000 * (time.perf_counter() - start) / len(contexts)
+
+        if reference is None:
+            reference = retrieved
+        r1, mrr = recall_and_mrr(retrieved, gold, 1)
+        r10, _ = recall_and_mrr(retrieved, gold, 10)
+        overlap = np.mean(
+            [100 * len(set(a) & set(b)) / args.k for a, b in zip(retrieved, reference)]
+        )
+        print(
+            f"{dtype:>8} {mib:>8.1f} {ms:>9.2f} {r1:>6.1f} {r10:>6.1f} "
+            f"{mrr:>6.3f} {overlap:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
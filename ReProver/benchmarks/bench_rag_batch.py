@@ -0,0 +1,82 @@
+"""Load-test ``rag_server.py``: N single ``/retrieve`` calls against one ``/retrieve_batch``
+call with the same N queries. Start the server first (``python rag_server.py``).
+
+Usage::
+
+    python benchmarks/bench_rag_batch.py --url http://localhost:5001 --batch-sizes 1 4 16 64
+"""
+
+import time
+import argparse
+import requests
+from loguru import logger
+from typing import List
+
+QUERY_TEMPLATES = [
+    "prove that addition is commutative",
+    "how to show two even numbers sum to even",
+    "simplify the goal using lemmas",
+    "divide both sides",
+    "the product of two odd numbers is odd",
+    "every natural number is zero or a successor",
+]
+
+
+def make_queries(n: int) -> List[str]:
+    """Return ``n`` distinct queries."""
+    return [f"{QUERY_TEMPLATES[i % len(QUERY_TEMPLATES)]} ({i})" for i in range(n)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare single and batched retrieval requests to the RAG server."
+    )
+    parser.add_argument("--url", type=str, default="http://localhost:5001")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    logger.info(args)
+
+    session = requests.Session()
+    session.get(f"{args.url}/health").raise_for_status()
+
+    print(f"{'N':>5} {'single q/s':>11} {'batch q/s':>10} {'speedup':>8}")
+    for n in args.batch_sizes:
+        queries = make_queries(n)
+
+        # Check that both endpoints agree before timing them.
+        batch = session.post(
+            f"{args.url}/retrieve_batch", json={"queries": queries, "k": args.k}
+        ).json()["results"]
+        for query, expected in zip(queries, batch):
+            results = session.post(
+                f"{args.url}/retrieve", json={"query": query, "k": args.k}
+            ).json()["results"]
+            assert [r["full_name"] for r in results] == [
+                r["full_name"] for r in expected["results"]
+            ]
+
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for query in queries:
+                session.post(
+                    f"{args.url}/retrieve", json={"query": query, "k": args.k}
+                ).raise_for_status()
+        t_single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            session.post(
+                f"{args.url}/retrieve_batch", json={"queries": queries, "k": args.k}
+            ).raise_for_status()
+        t_batch = time.perf_counter() - start
+
+        num_queries = n * args.repeats
+        print(
+            f"{n:>5} {num_queries / t_single:>11.1f} {num_queries / t_batch:>10.1f} {t_single / t_batch:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Benchmark ``MathLibRAG.retrieve`` with and without the query caches on a workload where
+popular queries are resent, as chatbot users do.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_rag_cache.py --corpus-path data/mathlib_corpus_minimal.jsonl
+"""
+
+import time
+import random
+import argparse
+from loguru import logger
+
+from simple_rag import MathLibRAG
+from bench_rag_batch import make_queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the MathLibRAG caches.")
+    parser.add_argument(
+        "--corpus-path", type=str, default="data/mathlib_corpus_minimal.jsonl"
+    )
+    parser.add_argument("--num-requests", type=int, default=2000)
+    parser.add_argument("--num-distinct", type=int, default=500)
+    parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+
+    distinct = make_queries(args.num_distinct)
+    weights = [1 / (i + 1) ** args.zipf_exponent for i in range(args.num_distinct)]
+    # Resent queries may differ in whitespace.
+    queries = [
+        q if random.random() < 0.5 else f" {q.replace(' ', '  ')}\n"
+        for q in random.choices(distinct, weights, k=args.num_requests)
+    ]
+
+    rag = MathLibRAG(args.corpus_path, cache_size=args.cache_size)
+    rag.build_index()
+    uncached = MathLibRAG(args.corpus_path, cache_size=0)
+    uncached.index = rag.index
+
+    timings = {}
+    for name, r in (("uncached", uncached), ("cached", rag)):
+        start = time.perf_counter()
+        results = [r.retrieve(q, k=args.k) for q in queries]
+        timings[name] = time.perf_counter() - start
+        names = [[res["full_name"] for res in rs] for rs in results]
+        if name == "uncached":
+            expected = names
+        else:
+            assert names == expected
+
+    print(f"{args.num_requests} requests, {args.num_distinct} distinct queries")
+    for name, t in timings.items():
+        print(f"{name}: {1000 * t / args.num_requests:.2f} ms/request")
+    print(f"speedup: {timings['uncached'] / timings['cached']:.1f}x")
+    print(rag.cache_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark the ``MathLibRAG`` corpus store: the previous pickled list of theorem dicts
+against ``TheoremTable``, on a synthetic corpus of Mathlib-like theorems.
+
+Each load runs in a fresh process, which reports its load time, its private (unshared)
+resident memory, and the time to materialize the top-k hits of a query.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_rag_corpus.py --num-theorems 300000
+"""
+
+import os
+import time
+import pickle
+import random
+import argparse
+import tempfile
+import multiprocessing as mp
+from loguru import logger
+from typing import Dict, List, Tuple
+
+from simple_rag import TheoremTable
+from bench_indexed_corpus_load import _private_mib
+
+
+def make_theorems(num_theorems: int) -> List[Dict[str, str]]:
+    rng = random.Random(0)
+    theorems = []
+    for i in range(num_theorems):
+        hyps = " ".join(
+            f"(h{h} : a + {h} ≤ b)" for h in range(int(rng.expovariate(0.2)))
+        )
+        theorems.append(
+            {
+                "full_name": f"Synthetic.Module{i // 100}.lemma_{i}",
+                "statement": f"theorem lemma_{i} (a b : Nat) {hyps} : a + {i} = {i} + a",
+                "module": f"Mathlib.Synthetic.Module{i // 100}",
+            }
+        )
+    return theorems
+
+
+def _load(path: str, k: int, num_queries: int, queue) -> None:
+    before = _private_mib()
+    start = time.perf_counter()
+    if os.path.isdir(path):
+        corpus = TheoremTable.load(path)
+    else:
+        with open(path, "rb") as inp:
+            corpus = pickle.load(inp)
+    t_load = time.perf_counter() - start
+    mib = _private_mib() - before
+
+    rng = random.Random(1)
+    hits = [[rng.randrange(len(corpus)) for _ in range(k)] for _ in range(num_queries)]
+    start = time.perf_counter()
+    for idxs in hits:
+        # As in MathLibRAG.retrieve_batch, which copied the dicts of the pickled corpus.
+        results = [dict(corpus[idx]) for idx in idxs]
+    t_hits = time.perf_counter() - start
+    queue.put((t_load, mib, 1e6 * t_hits / num_queries))
+
+
+def run(path: str, k: int, num_queries: int) -> Tuple[float, float, float]:
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_load, args=(path, k, num_queries, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the MathLibRAG corpus store."
+    )
+    parser.add_argument("--num-theorems", type=int, default=300000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--num-queries", type=int, default=10000)
+    args = parser.parse_args()
+    logger.info(args)
+
+    theorems = make_theorems(args.num_theorems)
+    with tempfile.TemporaryDirectory() as dirname:
+        pickle_path = os.path.join(dirname, "index.corpus.pkl")
+        start = time.perf_counter()
+        with open(pickle_path, "wb") as oup:
+            pickle.dump(theorems, oup)
+        t_save_pickle = time.perf_counter() - start
+
+        table_path = os.path.join(dirname, "index.corpus")
+        start = time.perf_counter()
+        table = TheoremTable.from_theorems(theorems)
+        table.save(table_path)
+        t_save_table = time.perf_counter() - start
+        assert list(TheoremTable.load(table_path)) == theorems
+        del theorems, table
+
+        print(f"{args.num_theorems} theorems, k = {args.k}")
+        print(f"{'':>12} {'save s':>7} {'load s':>7} {'MiB':>7} {'us/query':>9}")
+        for name, path, t_save in (
+            ("pickle", pickle_path, t_save_pickle),
+            ("TheoremTable", table_path, t_save_table),
+        ):
+            t_load, mib, us = run(path, args.k, args.num_queries)
+            print(f"{name:>12} {t_save:>7.2f} {t_load:>7.2f} {mib:>7.1f} {us:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
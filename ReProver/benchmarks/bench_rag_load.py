@@ -0,0 +1,74 @@
+"""Closed-loop load generator for ``rag_server.py``: each client thread sends ``/retrieve``
+requests back to back. Reports throughput and p50/p99 latency per concurrency level.
+Start the server first, e.g. ``RAG_MAX_BATCH_SIZE=1 python rag_server.py`` to disable
+request batching.
+
+Usage::
+
+    python benchmarks/bench_rag_load.py --url http://localhost:5001 --concurrency 1 4 16 32
+"""
+
+import time
+import argparse
+import threading
+import requests
+import numpy as np
+from loguru import logger
+from typing import List
+
+from bench_rag_batch import make_queries
+
+
+def run_clients(url: str, concurrency: int, duration: float, k: int) -> List[float]:
+    """Run ``concurrency`` clients for ``duration`` seconds and return all request latencies."""
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    queries = make_queries(1000)
+    start_barrier = threading.Barrier(concurrency)
+
+    def client(i: int) -> None:
+        session = requests.Session()
+        start_barrier.wait()
+        stop = time.perf_counter() + duration
+        j = i
+        while time.perf_counter() < stop:
+            query = queries[j % len(queries)]
+            j += concurrency
+            t = time.perf_counter()
+            session.post(
+                f"{url}/retrieve", json={"query": query, "k": k}
+            ).raise_for_status()
+            latencies[i].append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [l for ls in latencies for l in ls]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the RAG server.")
+    parser.add_argument("--url", type=str, default="http://localhost:5001")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds per level."
+    )
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+    logger.info(args)
+
+    requests.get(f"{args.url}/health").raise_for_status()
+    run_clients(args.url, 1, 1.0, args.k)  # Warm up.
+
+    print(f"{'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        latencies = np.array(run_clients(args.url, concurrency, args.duration, args.k))
+        p50, p99 = 1000 * np.percentile(latencies, [50, 99])
+        print(
+            f"{concurrency:>7} {len(latencies) / args.duration:>8.1f} {p50:>8.1f} {p99:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Start ``rag_server.py`` with different numbers of pre-forked workers and drive each
+at increasing concurrency. Reports throughput, p50/p99 latency, and the proportional
+set size (PSS) of all server processes, which counts shared pages once.
+
+Usage::
+
+    python benchmarks/bench_rag_serving.py --workers 1 2 4 --concurrency 1 8 32
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import requests
+import numpy as np
+from loguru import logger
+from typing import List
+
+from bench_rag_load import run_clients
+
+SERVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../rag_server.py"
+)
+
+
+def process_tree(pid: int) -> List[int]:
+    """Return ``pid`` and all its descendants."""
+    pids = [pid]
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{tid}/children") as inp:
+            for child in inp.read().split():
+                pids.extend(process_tree(int(child)))
+    return pids
+
+
+def pss_mib(pid: int) -> float:
+    """Return the total PSS of ``pid`` and its descendants in MiB (Linux only)."""
+    total_kib = 0
+    for p in process_tree(pid):
+        with open(f"/proc/{p}/smaps_rollup") as inp:
+            for line in inp:
+                if line.startswith("Pss:"):
+                    total_kib += int(line.split()[1])
+    return total_kib / 1024
+
+
+def wait_until_ready(url: str, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assert server.poll() is None, "The server exited during startup."
+        try:
+            requests.get(f"{url}/health", timeout=1).raise_for_status()
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    raise TimeoutError(f"The server did not start within {timeout} seconds.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the RAG server with pre-forked workers."
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds per level."
+    )
+    parser.add_argument("--port", type=int, default=5011)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    logger.info(args)
+    url = f"http://localhost:{args.port}"
+
+    print(
+        f"{'workers':>7} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'PSS MiB':>8}"
+    )
+    for num_workers in args.workers:
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                SERVER_PATH,
+                "--port",
+                str(args.port),
+                "--workers",
+                str(num_workers),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_ready(url, server, args.startup_timeout)
+            run_clients(url, num_workers, 1.0, args.k)  # Warm up every worker.
+            for concurrency in args.concurrency:
+                latencies = np.array(
+                    run_clients(url, concurrency, args.duration, args.k)
+                )
+                p50, p99 = 1000 * np.percentile(latencies, [50, 99])
+                print(
+                    f"{num_workers:>7} {concurrency:>7} {len(latencies) / args.duration:>8.1f} {p50:>8.1f} {p99:>8.1f} {pss_mib(server.pid):>8.1f}"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark ``get_recall_and_mrr`` against the previous per-K set intersection loop
+of ``PremiseRetriever.validation_step``, and check that both agree.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_retrieval_metrics.py --num-examples 10000 --k 100
+"""
+
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+from loguru import logger
+from typing import List, Tuple
+
+from common import Corpus, Premise, get_recall_and_mrr
+from synthetic import resolve_corpus_path
+
+
+def loop_recall_and_mrr(
+    retrieved_premises: List[List[Premise]],
+    all_pos_premises: List[List[Premise]],
+    k: int,
+) -> Tuple[List[float], float, int]:
+    """Reference implementation: the previous loop in ``validation_step``."""
+    recall = [[] for _ in range(k)]
+    MRR = []
+    num_with_premises = 0
+
+    for pos_premises, premises in zip(all_pos_premises, retrieved_premises):
+        pos_premises = set(pos_premises)
+        if len(pos_premises) == 0:
+            continue
+        else:
+            num_with_premises += 1
+        first_match_found = False
+
+        for j in range(k):
+            TP = len(pos_premises.intersection(premises[: (j + 1)]))
+            recall[j].append(float(TP) / len(pos_premises))
+            if premises[j] in pos_premises and not first_match_found:
+                MRR.append(1.0 / (j + 1))
+                first_match_found = True
+        if not first_match_found:
+            MRR.append(0.0)
+
+    return [100 * np.mean(_) for _ in recall], np.mean(MRR), num_with_premises
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the vectorized retrieval metrics."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=200)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument("--num-examples", type=int, default=10000)
+    parser.add_argument("--k", type=int, default=100)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus = Corpus(
+            resolve_corpus_path(
+                args.corpus_path, dirname, args.num_files, args.premises_per_file
+            )
+        )
+    retrieved = []
+    gold = []
+    for _ in range(args.num_examples):
+        premises = random.sample(corpus.all_premises, args.k)
+        retrieved.append(premises)
+        # Some examples have no ground truth premises, and some are not retrieved.
+        pos = random.sample(premises, random.randint(0, 3))
+        pos += random.sample(corpus.all_premises, random.randint(0, 2))
+        gold.append(pos)
+
+    start = time.perf_counter()
+    recall_loop, mrr_loop, n_loop = loop_recall_and_mrr(retrieved, gold, args.k)
+    t_loop = time.perf_counter() - start
+    start = time.perf_counter()
+    recall, mrr, n = get_recall_and_mrr(retrieved, gold, args.k)
+    t_vectorized = time.perf_counter() - start
+
+    assert n == n_loop
+    assert np.allclose(recall, recall_loop) and np.isclose(mrr, mrr_loop)
+    print(f"{args.num_examples} examples, K = {args.k}")
+    print(f"loop:       {t_loop:.3f} s")
+    print(f"vectorized: {t_vectorized:.3f} s ({t_loop / t_vectorized:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark ``Premise.serialize`` per premise: the previous implementation, the current
+one computed from scratch, and the cached value read from a ``PremiseTable``.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_serialize.py --corpus-path data/leandojo_benchmark_4/corpus.jsonl
+"""
+
+import re
+import json
+import time
+import argparse
+import tempfile
+from loguru import logger
+from typing import Callable, List
+
+from common import (
+    MARK_START_SYMBOL,
+    MARK_END_SYMBOL,
+    File,
+    Premise,
+    PremiseTable,
+    _serialize_premise,
+)
+from synthetic import resolve_corpus_path
+
+
+def legacy_serialize(p: Premise) -> str:
+    """Reference implementation: the previous ``Premise.serialize``."""
+    annot_full_name = f"{MARK_START_SYMBOL}{p.full_name}{MARK_END_SYMBOL}"
+    code = p.code.replace(f"_root_.{p.full_name}", annot_full_name)
+    fields = p.full_name.split(".")
+
+    for i in range(len(fields)):
+        prefix = ".".join(fields[i:])
+        new_code = re.sub(rf"(?<=\s)«?{prefix}»?", annot_full_name, code)
+        if new_code != code:
+            code = new_code
+            break
+
+    return code
+
+
+def us_per_premise(fn: Callable[[Premise], str], premises: List[Premise]) -> float:
+    start = time.perf_counter()
+    for p in premises:
+        fn(p)
+    return 1e6 * (time.perf_counter() - start) / len(premises)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Premise.serialize.")
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=400)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    args = parser.parse_args()
+    logger.info(args)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus_path = resolve_corpus_path(
+            args.corpus_path, dirname, args.num_files, args.premises_per_file
+        )
+        files = [File.from_data(json.loads(line)) for line in open(corpus_path)]
+    premises = [p for f in files for p in f.premises]
+
+    expected = [legacy_serialize(p) for p in premises]
+    assert [_serialize_premise(p.full_name, p.code) for p in premises] == expected
+
+    t_legacy = us_per_premise(legacy_serialize, premises)
+    t_uncached = us_per_premise(
+        lambda p: _serialize_premise(p.full_name, p.code), premises
+    )
+    table = PremiseTable.from_files(files)
+    views = list(table)
+    t_cached = us_per_premise(Premise.serialize, views)
+    assert [p.serialize() for p in views] == expected
+
+    print(f"{len(premises)} premises, us per premise:")
+    print(f"previous serialize: {t_legacy:.2f}")
+    print(f"serialize (uncached): {t_uncached:.2f} ({t_legacy / t_uncached:.1f}x)")
+    print(f"serialize (cached): {t_cached:.2f} ({t_legacy / t_cached:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark ``Corpus.get_nearest_premises_sliced`` against the full-matrix
+``Corpus.get_nearest_premises``, overall and by the fraction of the corpus
+accessible to each context.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_sliced_search.py --corpus-path data/leandojo_benchmark_4/corpus.jsonl
+"""
+
+import time
+import torch
+import random
+import argparse
+import tempfile
+import numpy as np
+import torch.nn.functional as F
+from loguru import logger
+from typing import List
+
+from common import Corpus, Context
+from synthetic import resolve_corpus_path
+from bench_nearest_premises import sample_contexts
+
+
+def run(search, contexts: List[Context], query_embs: torch.Tensor, batch_size: int):
+    scores = []
+    start = time.perf_counter()
+    for i in range(0, len(contexts), batch_size):
+        _, s = search(contexts[i : i + batch_size], query_embs[i : i + batch_size])
+        scores.extend(s)
+    return 1000 * (time.perf_counter() - start) / len(contexts), scores
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark sliced against full-matrix nearest premise search."
+    )
+    parser.add_argument(
+        "--corpus-path",
+        type=str,
+        default=None,
+        help="A corpus.jsonl file. A synthetic corpus is generated if omitted.",
+    )
+    parser.add_argument("--num-files", type=int, default=2000)
+    parser.add_argument("--premises-per-file", type=int, default=50)
+    parser.add_argument(
+        "--max-imports",
+        type=int,
+        default=4,
+        help="Direct imports per synthetic file; more imports make more premises accessible.",
+    )
+    parser.add_argument("--dim", type=int, default=1472)
+    parser.add_argument("--num-queries", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--max-fraction", type=float, default=0.1)
+    args = parser.parse_args()
+    logger.info(args)
+    random.seed(0)
+    torch.manual_seed(0)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        corpus = Corpus(
+            resolve_corpus_path(
+                args.corpus_path,
+                dirname,
+                args.num_files,
+                args.premises_per_file,
+                args.max_imports,
+            )
+        )
+    embeddings = F.normalize(torch.randn(len(corpus), args.dim), dim=1)
+    contexts = sample_contexts(corpus, args.num_queries, args.k)
+    fractions = np.array(
+        [
+            corpus.get_accessible_premise_mask(ctx.path, ctx.theorem_pos)
+            .float()
+            .mean()
+            .item()
+            for ctx in contexts
+        ]
+    )
+    # Group contexts by accessible fraction so that each batch is homogeneous.
+    order = np.argsort(fractions)
+    contexts = [contexts[i] for i in order]
+    fractions = fractions[order]
+    query_embs = F.normalize(torch.randn(len(contexts), args.dim), dim=1)
+    num_ranges = [len(corpus.get_imported_ranges(ctx.path)) for ctx in contexts]
+    print(
+        f"{len(corpus)} premises, accessible fraction: median {np.median(fractions):.2f}, "
+        f"mean {fractions.mean():.2f}; imported ranges per file: "
+        f"median {np.median(num_ranges):.0f}, max {max(num_ranges)}"
+    )
+
+    print(f"{'contexts':>22} {'full ms/q':>10} {'sliced ms/q':>12} {'speedup':>8}")
+    buckets = np.array_split(np.arange(len(contexts)), 4)
+    for name, idxs in [("all", np.arange(len(contexts)))] + [
+        (
+            f"fraction {fractions[b[0]]:.2f}-{fractions[b[-1]]:.2f}",
+            b,
+        )
+        for b in buckets
+    ]:
+        ctxs = [contexts[i] for i in idxs]
+        embs = query_embs[idxs]
+        t_full, s_full = run(
+            lambda c, e: corpus.get_nearest_premises(embeddings, c, e, args.k),
+            ctxs,
+            embs,
+            args.batch_size,
+        )
+        t_sliced, s_sliced = run(
+            lambda c, e: corpus.get_nearest_premises_sliced(
+                embeddings, c, e, args.k, max_fraction=args.max_fraction
+            ),
+            ctxs,
+            embs,
+            args.batch_size,
+        )
+        assert np.allclose(s_full, s_sliced, atol=1e-4)
+        print(
+            f"{name:>22} {t_full:>10.2f} {t_sliced:>12.2f} {t_full / t_sliced:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
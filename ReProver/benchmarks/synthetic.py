@@ -0,0 +1,70 @@
+"""Synthetic ``corpus.jsonl`` generator shared by the benchmark scripts.
+
+The layout mimics LeanDojo's corpus format: files are emitted in topological
+order, each importing a few earlier files, and each defining a run of premises
+at increasing positions.
+"""
+
+import os
+import json
+import random
+from typing import Optional
+
+
+def make_synthetic_corpus(
+    output_dir: str,
+    num_files: int,
+    premises_per_file: int,
+    max_imports: int = 4,
+    seed: int = 0,
+) -> str:
+    """Write a synthetic ``corpus.jsonl`` to ``output_dir`` and return its path."""
+    rng = random.Random(seed)
+    path = os.path.join(output_dir, "corpus.jsonl")
+
+    with open(path, "w") as oup:
+        for i in range(num_files):
+            file_path = f"Mathlib/Synthetic/File{i}.lean"
+            num_imports = min(i, rng.randint(0, max_imports))
+            imports = [
+                f"Mathlib/Synthetic/File{j}.lean"
+                for j in sorted(rng.sample(range(i), num_imports))
+            ]
+            premises = []
+            for k in range(premises_per_file):
+                full_name = f"Synthetic.File{i}.lemma_{k}"
+                line = 3 + 4 * k
+                # Premise lengths are long-tailed, as in Mathlib.
+                hyps = " ".join(
+                    f"(h{h} : a + {h} ≤ b)" for h in range(int(rng.expovariate(0.2)))
+                )
+                premises.append(
+                    {
+                        "full_name": full_name,
+                        "code": f"theorem lemma_{k} (a b : Nat) {hyps}: a + {k} = {k} + a :=\n  Nat.add_comm _ _",
+                        "start": [line, 1],
+                        "end": [line + 1, 19],
+                        "kind": "commanddeclaration",
+                    }
+                )
+            oup.write(
+                json.dumps(
+                    {"path": file_path, "imports": imports, "premises": premises}
+                )
+                + "\n"
+            )
+
+    return path
+
+
+def resolve_corpus_path(
+    corpus_path: Optional[str],
+    output_dir: str,
+    num_files: int,
+    premises_per_file: int,
+    max_imports: int = 4,
+) -> str:
+    """Return ``corpus_path`` if given, otherwise generate a synthetic corpus."""
+    if corpus_path is not None:
+        return corpus_path
+    return make_synthetic_corpus(output_dir, num_files, premises_per_file, max_imports)
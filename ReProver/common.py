@@ -2,20 +2,25 @@ import os
 import re
 import sys
 import json
+import bisect
 import random
+import hashlib
 import torch
+import numpy as np
+import torch.nn.functional as F
 import tempfile
-import networkx as nx
 from loguru import logger
 from lean_dojo import Pos
 import pytorch_lightning as pl
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping, Sequence
 from dataclasses import dataclass, field
 from pytorch_lightning.utilities.deepspeed import (
     convert_zero_checkpoint_to_fp32_state_dict,
 )
 from transformers import get_constant_schedule_with_warmup
 from deepspeed.ops.adam import FusedAdam, DeepSpeedCPUAdam
-from typing import Optional, List, Dict, Any, Tuple, Generator
+from typing import Optional, List, Dict, Any, Tuple, Generator, Hashable, Iterator
 from pytorch_lightning.strategies.deepspeed import DeepSpeedStrategy
 
 
@@ -26,6 +31,37 @@ MARK_START_SYMBOL = "<a>"
 MARK_END_SYMBOL = "</a>"
 
 
+def _pos_key(pos: Pos) -> int:
+    """Encode ``pos`` as an integer that preserves the ordering of positions."""
+    return (pos.line_nb << 32) | pos.column_nb
+
+
+def _position_keys(positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Apply :func:`_pos_key` to the start and end positions in :attr:`PremiseTable.positions`."""
+    return (
+        (positions[:, 0] << 32) | positions[:, 1],
+        (positions[:, 2] << 32) | positions[:, 3],
+    )
+
+
+def _interval_index(
+    start_keys: np.ndarray, end_keys: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sort the premises of a file by start position. Return the sorted start keys, the
+    running maximum of the end keys in that order, and the order.
+    """
+    order = np.argsort(start_keys, kind="stable")
+    return start_keys[order], np.maximum.accumulate(end_keys[order]), order
+
+
+def _pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate ``strings`` into one UTF-8 buffer and return it with the offsets of each string."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
 def remove_marks(s: str) -> str:
     """Remove all :code:`<a>` and :code:`</a>` from ``s``."""
     return s.replace(MARK_START_SYMBOL, "").replace(MARK_END_SYMBOL, "")
@@ -80,6 +116,14 @@ class Premise:
     """Raw, human-written code for defining the premise.
     """
 
+    _serialized: Optional[str] = field(default=None, repr=False, compare=False)
+    """Cached output of :meth:`serialize`.
+    """
+
+    _serialized_nbytes: Optional[int] = field(default=None, repr=False, compare=False)
+    """Cached output of :meth:`serialized_nbytes`.
+    """
+
     def __post_init__(self) -> None:
         assert isinstance(self.path, str)
         assert isinstance(self.full_name, str)
@@ -92,18 +136,41 @@ class Premise:
 
     def serialize(self) -> str:
         """Serialize the premise into a string for Transformers."""
-        annot_full_name = f"{MARK_START_SYMBOL}{self.full_name}{MARK_END_SYMBOL}"
-        code = self.code.replace(f"_root_.{self.full_name}", annot_full_name)
-        fields = self.full_name.split(".")
+        if self._serialized is None:
+            self._serialized = _serialize_premise(self.full_name, self.code)
+        return self._serialized
+
+    def serialized_nbytes(self) -> int:
+        """Return the length of :meth:`serialize` in UTF-8 bytes."""
+        if self._serialized_nbytes is None:
+            self._serialized_nbytes = len(self.serialize().encode("utf-8"))
+        return self._serialized_nbytes
+
+
+_REGEX_METACHARS = frozenset("\\^$*+?{}[]|()")
 
-        for i in range(len(fields)):
-            prefix = ".".join(fields[i:])
-            new_code = re.sub(f"(?<=\s)«?{prefix}»?", annot_full_name, code)
-            if new_code != code:
-                code = new_code
-                break
 
-        return code
+def _serialize_premise(full_name: str, code: str) -> str:
+    """Annotate the first suffix of ``full_name`` that occurs in ``code`` with
+    :code:`<a>` and :code:`</a>`, as done by :meth:`Premise.serialize`.
+    """
+    annot_full_name = f"{MARK_START_SYMBOL}{full_name}{MARK_END_SYMBOL}"
+    code = code.replace(f"_root_.{full_name}", annot_full_name)
+    fields = full_name.split(".")
+    # Apart from ".", a name without regex metacharacters can only match if all its
+    # dot-separated fields occur in the code, which is much cheaper than a regex.
+    literal = _REGEX_METACHARS.isdisjoint(full_name)
+
+    for i in range(len(fields)):
+        if literal and not all(f in code for f in fields[i:]):
+            continue
+        prefix = ".".join(fields[i:])
+        new_code = re.sub(rf"(?<=\s)«?{prefix}»?", annot_full_name, code)
+        if new_code != code:
+            code = new_code
+            break
+
+    return code
 
 
 class PremiseSet:
@@ -138,6 +205,37 @@ class PremiseSet:
         return sum(len(premises) for premises in self.path2premises.values())
 
 
+class _PremiseSubset(PremiseSet):
+    """A :class:`PremiseSet` holding a boolean mask over :attr:`Corpus.all_premises`.
+    Premises in the mask are only created when iterated over, and membership is checked
+    by position and full name. Premises added later are stored as in :class:`PremiseSet`.
+    """
+
+    def __init__(self, corpus: "Corpus", mask: np.ndarray) -> None:
+        super().__init__()
+        self.corpus = corpus
+        self.mask = mask
+
+    def __iter__(self) -> Generator[Premise, None, None]:
+        for i in np.flatnonzero(self.mask).tolist():
+            yield self.corpus.all_premises[i]
+        yield from super().__iter__()
+
+    def _in_mask(self, p: Premise) -> bool:
+        i = self.corpus.find_premise(p.path, p.full_name, p.start)
+        return i is not None and bool(self.mask[i])
+
+    def add(self, p: Premise) -> None:
+        if not self._in_mask(p):
+            super().add(p)
+
+    def __contains__(self, p: Premise) -> bool:
+        return self._in_mask(p) or super().__contains__(p)
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.mask)) + super().__len__()
+
+
 @dataclass(frozen=True)
 class File:
     """A file defines 0 or multiple premises."""
@@ -178,69 +276,485 @@ class File:
         return self.premises == []
 
 
+class PremiseTable(Sequence):
+    """A read-only list of premises stored column by column: the path of each file once,
+    the files' offsets into the premises, the start and end positions as one integer
+    array, and the full names and code as UTF-8 buffers with offsets.
+
+    :class:`Premise` objects are created when accessed and not kept, so the table takes
+    a small fraction of the memory of a list of premises. The columns can also be
+    memory-mapped from a corpus snapshot (see :meth:`Corpus.save_snapshot`).
+    The output of :meth:`Premise.serialize` is stored as a column too, so it is only
+    computed once per premise.
+    """
+
+    paths: List[str]
+    """Paths of the files in topological order.
+    """
+
+    file_offsets: np.ndarray
+    """Premises of the ``i``-th file occupy ``file_offsets[i] : file_offsets[i + 1]``.
+    """
+
+    positions: np.ndarray
+    """Start line, start column, end line, and end column of each premise.
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        file_offsets: np.ndarray,
+        positions: np.ndarray,
+        names: np.ndarray,
+        name_offsets: np.ndarray,
+        code: np.ndarray,
+        code_offsets: np.ndarray,
+        serialized: Optional[np.ndarray] = None,
+        serialized_offsets: Optional[np.ndarray] = None,
+    ) -> None:
+        assert len(file_offsets) == len(paths) + 1
+        assert file_offsets[-1] == len(positions)
+        self.paths = paths
+        self.file_offsets = file_offsets
+        self._file_starts = file_offsets[:-1].tolist()
+        self.positions = positions
+        self.names = names
+        self.name_offsets = name_offsets
+        self.code = code
+        self.code_offsets = code_offsets
+        self.serialized = serialized
+        self.serialized_offsets = serialized_offsets
+
+    @classmethod
+    def from_files(cls, files: List[File]) -> "PremiseTable":
+        """Pack the premises of ``files`` into a table."""
+        premises = [p for file in files for p in file.premises]
+        file_offsets = np.zeros(len(files) + 1, dtype=np.int64)
+        np.cumsum([len(file.premises) for file in files], out=file_offsets[1:])
+        positions = np.array(
+            [(*p.start, *p.end) for p in premises], dtype=np.int64
+        ).reshape(-1, 4)
+        names, name_offsets = _pack_strings([p.full_name for p in premises])
+        code, code_offsets = _pack_strings([p.code for p in premises])
+        serialized, serialized_offsets = _pack_strings(
+            [p.serialize() for p in premises]
+        )
+        return cls(
+            [file.path for file in files],
+            file_offsets,
+            positions,
+            names,
+            name_offsets,
+            code,
+            code_offsets,
+            serialized,
+            serialized_offsets,
+        )
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def _premise(self, i: int, path: Optional[str] = None) -> Premise:
+        if path is None:
+            path = self.paths[bisect.bisect_right(self._file_starts, i) - 1]
+        line_start, col_start, line_end, col_end = self.positions[i].tolist()
+        name_start, name_end = self.name_offsets[i : i + 2].tolist()
+        code_start, code_end = self.code_offsets[i : i + 2].tolist()
+        if self.serialized is None:
+            serialized = serialized_nbytes = None
+        else:
+            start, end = self.serialized_offsets[i : i + 2].tolist()
+            serialized = self.serialized[start:end].tobytes().decode("utf-8")
+            serialized_nbytes = end - start
+        return Premise(
+            path,
+            self.names[name_start:name_end].tobytes().decode("utf-8"),
+            Pos(line_start, col_start),
+            Pos(line_end, col_end),
+            self.code[code_start:code_end].tobytes().decode("utf-8"),
+            serialized,
+            serialized_nbytes,
+        )
+
+    def full_name(self, i: int) -> str:
+        """Return the full name of the ``i``-th premise without creating it."""
+        start, end = self.name_offsets[i : i + 2].tolist()
+        return self.names[start:end].tobytes().decode("utf-8")
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._premise(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self._premise(idx)
+
+    def file_premises(self, file_idx: int) -> List[Premise]:
+        """Return the premises defined in the ``file_idx``-th file."""
+        path = self.paths[file_idx]
+        start, end = self.file_offsets[file_idx : file_idx + 2].tolist()
+        return [self._premise(i, path) for i in range(start, end)]
+
+
+class FileTable(Mapping):
+    """A read-only ``path -> File`` mapping over a :class:`PremiseTable`,
+    creating :class:`File` objects when accessed.
+    """
+
+    def __init__(self, premises: PremiseTable) -> None:
+        self.premises = premises
+        self.path_idxs = {path: i for i, path in enumerate(premises.paths)}
+
+    def __getitem__(self, path: str) -> File:
+        return File(path, self.premises.file_premises(self.path_idxs[path]))
+
+    def __contains__(self, path: object) -> bool:
+        return path in self.path_idxs
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.premises.paths)
+
+    def __len__(self) -> int:
+        return len(self.premises.paths)
+
+
+class DependencyClosure:
+    """Transitive closure of the dependency graph among files, stored as a bit matrix.
+
+    Files are numbered in topological order. Row ``i`` of :attr:`bits` is a bitmap
+    (packed with :func:`numpy.packbits`) of the files imported by file ``i``,
+    directly or indirectly. It supports the subset of the :class:`networkx.DiGraph`
+    interface used by :class:`Corpus` in O(files^2 / 8) bytes.
+    """
+
+    paths: List[str]
+    """Paths of all files in topological order.
+    """
+
+    path_idxs: Dict[str, int]
+    """Index of each path in :attr:`paths`.
+    """
+
+    bits: np.ndarray
+    """Packed reachability matrix of shape ``(len(paths), ceil(len(paths) / 8))``.
+    """
+
+    def __init__(self, paths: List[str], bits: np.ndarray) -> None:
+        assert bits.shape == (len(paths), (len(paths) + 7) // 8)
+        self.paths = paths
+        self.path_idxs = {path: i for i, path in enumerate(paths)}
+        self.bits = bits
+
+    @classmethod
+    def from_imports(cls, imports: Dict[str, List[str]]) -> "DependencyClosure":
+        """Compute the closure from the direct imports of each file.
+
+        ``imports`` must be ordered such that every file comes after its imports,
+        which also guarantees that the dependency graph is acyclic.
+        """
+        paths = list(imports)
+        path_idxs = {path: i for i, path in enumerate(paths)}
+        bits = np.zeros((len(paths), (len(paths) + 7) // 8), dtype=np.uint8)
+
+        for i, path in enumerate(paths):
+            for dep in imports[path]:
+                j = path_idxs[dep]
+                assert j < i, f"{path} imports {dep}, which comes after it"
+                bits[i] |= bits[j]
+                bits[i, j >> 3] |= 0x80 >> (j & 7)
+
+        return cls(paths, bits)
+
+    @property
+    def nodes(self) -> List[str]:
+        return self.paths
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.path_idxs
+
+    def row(self, path: str) -> np.ndarray:
+        """Return an unpacked boolean bitmap of the files imported by ``path``."""
+        return np.unpackbits(
+            self.bits[self.path_idxs[path]], count=len(self.paths)
+        ).view(bool)
+
+    def successors(self, path: str) -> List[str]:
+        """Return the files imported by ``path``, directly or indirectly."""
+        return [self.paths[j] for j in np.flatnonzero(self.row(path))]
+
+    def has_edge(self, src: str, dst: str) -> bool:
+        """Check whether ``src`` imports ``dst``, directly or indirectly."""
+        i = self.path_idxs[src]
+        j = self.path_idxs[dst]
+        return bool(self.bits[i, j >> 3] & (0x80 >> (j & 7)))
+
+
 class Corpus:
     """Our retrieval corpus is a DAG of files. Each file consists of
     premises (theorems, definitoins, etc.) that can be retrieved.
     """
 
-    transitive_dep_graph: nx.DiGraph
+    transitive_dep_graph: DependencyClosure
     """Transitive closure of the dependency graph among files. 
     There is an edge from file X to Y iff X import Y (directly or indirectly).
     """
 
-    all_premises: List[Premise]
+    path2file: FileTable
+    """All files in the corpus indexed by their paths, in topological order.
+    """
+
+    all_premises: PremiseTable
     """All premises in the entire corpus.
     """
 
+    premise_ranges: Dict[str, Tuple[int, int]]
+    """Half-open range of indexes in :attr:`all_premises` occupied by each file's premises.
+    """
+
+    imported_premise_bitmaps: Dict[str, np.ndarray]
+    """Per-file bitmap over :attr:`all_premises` (packed with :func:`numpy.packbits`)
+    of the premises defined in the file's (transitively) imported files.
+    """
+
+    premise_end_keys: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    """Per-file sorted end positions (encoded by :func:`_pos_key`) of the premises
+    defined in the file, together with their offsets in the file's premise range.
+    """
+
+    premise_intervals: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]
+    """Per-file interval index for :meth:`locate_premise` (see :func:`_interval_index`).
+    """
+
     def __init__(self, jsonl_path: str) -> None:
         """Construct a :class:`Corpus` object from a ``corpus.jsonl`` data file."""
-        dep_graph = nx.DiGraph()
-        self.all_premises = []
+        imports = {}
+        files = []
 
         logger.info(f"Building the corpus from {jsonl_path}")
 
         for line in open(jsonl_path):
             file_data = json.loads(line)
             path = file_data["path"]
-            assert not dep_graph.has_node(path)
-            file = File.from_data(file_data)
-
-            dep_graph.add_node(path, file=file)
-            self.all_premises.extend(file.premises)
+            assert path not in imports
+            files.append(File.from_data(file_data))
 
             for p in file_data["imports"]:
-                assert dep_graph.has_node(p)
-                dep_graph.add_edge(path, p)
+                assert p in imports
+            imports[path] = file_data["imports"]
+
+        self._build(files, imports)
+
+    def _build(self, files: List[File], imports: Dict[str, List[str]]) -> None:
+        """Build the corpus from its files in topological order and their imports."""
+        self.premise_ranges = {}
+        num_premises = 0
+        for file in files:
+            self.premise_ranges[file.path] = (
+                num_premises,
+                num_premises + len(file.premises),
+            )
+            num_premises += len(file.premises)
 
-        assert nx.is_directed_acyclic_graph(dep_graph)
-        self.transitive_dep_graph = nx.transitive_closure_dag(dep_graph)
+        self.transitive_dep_graph = DependencyClosure.from_imports(imports)
+        self.all_premises = PremiseTable.from_files(files)
+        self.path2file = FileTable(self.all_premises)
 
-        self.imported_premises_cache = {}
+        self.imported_premise_bitmaps = {}
+        self.premise_end_keys = {}
+        self.premise_intervals = {}
         self.fill_cache()
 
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Unpickle a corpus, rebuilding it if it was pickled in an older layout
+        (e.g., inside an ``IndexedCorpus`` written by an older ``retrieval/index.py``).
+        """
+        premises = state["all_premises"]
+        if isinstance(premises, PremiseTable):
+            # Tables pickled before serialized premises were stored.
+            premises.__dict__.setdefault("serialized", None)
+            premises.__dict__.setdefault("serialized_offsets", None)
+            if "premise_intervals" in state:
+                self.__dict__.update(state)
+                return
+
+        logger.info("Rebuilding a corpus pickled in an older layout")
+        graph = state["transitive_dep_graph"]
+        paths = list(graph.nodes)
+        if "premise_ranges" in state:
+            files = [
+                File(path, list(premises[start:end]))
+                for path, (start, end) in (
+                    (path, state["premise_ranges"][path]) for path in paths
+                )
+            ]
+        else:  # A `networkx.DiGraph` holding the files.
+            files = [graph.nodes[path]["file"] for path in paths]
+        # The transitive closure serves as the imports; its closure is itself.
+        self._build(files, {path: list(graph.successors(path)) for path in paths})
+
+    SNAPSHOT_VERSION = 3
+    """Version 2 adds serialized premises, and version 3 the interval index.
+    Older snapshots can still be loaded.
+    """
+
+    def save_snapshot(self, dirname: str) -> None:
+        """Save the corpus to ``dirname`` as columnar ``*.npy`` arrays that
+        :meth:`load_snapshot` can memory-map.
+        """
+        os.makedirs(dirname, exist_ok=True)
+        paths = self.transitive_dep_graph.nodes
+        table = self.all_premises
+        if table.serialized is None:  # Loaded from a version 1 snapshot.
+            serialized, serialized_offsets = _pack_strings(
+                [p.serialize() for p in table]
+            )
+        else:
+            serialized, serialized_offsets = (
+                table.serialized,
+                table.serialized_offsets,
+            )
+
+        arrays = {
+            "file_offsets": table.file_offsets,
+            "closure": self.transitive_dep_graph.bits,
+            "positions": table.positions,
+            "names": table.names,
+            "name_offsets": table.name_offsets,
+            "code": table.code,
+            "code_offsets": table.code_offsets,
+            "serialized": serialized,
+            "serialized_offsets": serialized_offsets,
+            "imported_premise_bitmaps": np.stack(
+                [self.imported_premise_bitmaps[path] for path in paths]
+            ),
+            "end_keys": np.concatenate(
+                [self.premise_end_keys[path][0] for path in paths]
+            ),
+            "end_order": np.concatenate(
+                [self.premise_end_keys[path][1] for path in paths]
+            ),
+            "start_keys": np.concatenate(
+                [self.premise_intervals[path][0] for path in paths]
+            ),
+            "max_end_keys": np.concatenate(
+                [self.premise_intervals[path][1] for path in paths]
+            ),
+            "start_order": np.concatenate(
+                [self.premise_intervals[path][2] for path in paths]
+            ),
+        }
+        for name, arr in arrays.items():
+            np.save(os.path.join(dirname, f"{name}.npy"), arr)
+
+        with open(os.path.join(dirname, "meta.json"), "wt") as oup:
+            json.dump(
+                {
+                    "version": self.SNAPSHOT_VERSION,
+                    "num_premises": len(self.all_premises),
+                    "paths": paths,
+                },
+                oup,
+            )
+        logger.info(f"Corpus snapshot saved to {dirname}")
+
+    @classmethod
+    def load_snapshot(cls, dirname: str, mmap: bool = True) -> "Corpus":
+        """Load a corpus saved by :meth:`save_snapshot` without re-parsing ``corpus.jsonl``.
+
+        With ``mmap``, the arrays are memory-mapped, so loading takes time independent of
+        the corpus size, and processes loading the same snapshot share its pages.
+        """
+        with open(os.path.join(dirname, "meta.json")) as inp:
+            meta = json.load(inp)
+        if meta["version"] not in (1, 2, cls.SNAPSHOT_VERSION):
+            raise ValueError(
+                f"Unsupported corpus snapshot version {meta['version']} in {dirname}"
+            )
+
+        mmap_mode = "r" if mmap else None
+
+        def arr(name: str) -> np.ndarray:
+            # Plain ndarray views of np.memmap are much cheaper to slice.
+            return np.asarray(
+                np.load(os.path.join(dirname, f"{name}.npy"), mmap_mode=mmap_mode)
+            )
+
+        paths = meta["paths"]
+        file_offsets = arr("file_offsets")
+        bitmaps = arr("imported_premise_bitmaps")
+        end_keys = arr("end_keys")
+        end_order = arr("end_order")
+
+        corpus = cls.__new__(cls)
+        corpus.transitive_dep_graph = DependencyClosure(paths, arr("closure"))
+        corpus.all_premises = PremiseTable(
+            paths,
+            file_offsets,
+            arr("positions"),
+            arr("names"),
+            arr("name_offsets"),
+            arr("code"),
+            arr("code_offsets"),
+            *(
+                (arr("serialized"), arr("serialized_offsets"))
+                if meta["version"] >= 2
+                else ()
+            ),
+        )
+        corpus.path2file = FileTable(corpus.all_premises)
+        corpus.premise_ranges = {}
+        corpus.imported_premise_bitmaps = {}
+        corpus.premise_end_keys = {}
+        corpus.premise_intervals = {}
+        if meta["version"] >= 3:
+            intervals = (arr("start_keys"), arr("max_end_keys"), arr("start_order"))
+        else:
+            all_start_keys, all_end_keys = _position_keys(corpus.all_premises.positions)
+        for i, (start, end) in enumerate(
+            zip(file_offsets[:-1].tolist(), file_offsets[1:].tolist())
+        ):
+            corpus.premise_ranges[paths[i]] = (start, end)
+            corpus.imported_premise_bitmaps[paths[i]] = bitmaps[i]
+            corpus.premise_end_keys[paths[i]] = (
+                end_keys[start:end],
+                end_order[start:end],
+            )
+            corpus.premise_intervals[paths[i]] = (
+                tuple(a[start:end] for a in intervals)
+                if meta["version"] >= 3
+                else _interval_index(all_start_keys[start:end], all_end_keys[start:end])
+            )
+
+        assert len(corpus.all_premises) == meta["num_premises"]
+        return corpus
+
     def _get_file(self, path: str) -> File:
-        return self.transitive_dep_graph.nodes[path]["file"]
+        return self.path2file[path]
 
     def __len__(self) -> int:
         return len(self.all_premises)
 
     def __contains__(self, path: str) -> bool:
-        return path in self.transitive_dep_graph
+        return path in self.path2file
 
     def __getitem__(self, idx: int) -> Premise:
         return self.all_premises[idx]
 
     @property
     def files(self) -> List[File]:
-        return [self._get_file(p) for p in self.transitive_dep_graph.nodes]
+        return list(self.path2file.values())
 
     @property
     def num_files(self) -> int:
-        return len(self.files)
+        return len(self.path2file)
 
     def get_dependencies(self, path: str) -> List[str]:
         """Return a list of (direct and indirect) dependencies of the file ``path``."""
-        return list(self.transitive_dep_graph.successors(path))
+        return self.transitive_dep_graph.successors(path)
 
     def get_premises(self, path: str) -> List[Premise]:
         """Return a list of premises defined in the file ``path``."""
@@ -248,53 +762,217 @@ class Corpus:
 
     def num_premises(self, path: str) -> int:
         """Return the number of premises defined in the file ``path``."""
-        return len(self.get_premises(path))
+        start, end = self.premise_ranges[path]
+        return end - start
+
+    def find_premise(self, path: str, full_name: str, pos: Pos) -> Optional[int]:
+        """Return the index in :attr:`all_premises` of the premise ``full_name`` starting at
+        ``pos`` in file ``path``, or None if there is no such premise.
+        """
+        if path not in self.premise_ranges:
+            return None
+        start, _ = self.premise_ranges[path]
+        start_keys, _, order = self.premise_intervals[path]
+        key = _pos_key(pos)
+        j = int(np.searchsorted(start_keys, key, side="left"))
+        while j < len(start_keys) and start_keys[j] == key:
+            i = start + int(order[j])
+            if self.all_premises.full_name(i) == full_name:
+                return i
+            j += 1
+        return None
 
     def locate_premise(self, path: str, pos: Pos) -> Optional[Premise]:
         """Return a premise at position ``pos`` in file ``path``.
 
-        Return None if no such premise can be found.
+        Return None if no such premise can be found. If several premises contain ``pos``,
+        return the one defined first.
         """
-        for p in self.get_premises(path):
-            assert p.path == path
-            if p.start <= pos <= p.end:
-                return p
-        return None
+        start, _ = self.premise_ranges[path]
+        start_keys, max_end_keys, order = self.premise_intervals[path]
+        key = _pos_key(pos)
+        # Going backwards from the last premise starting at or before `pos`, premises
+        # may contain `pos` until the running maximum of their ends falls before it.
+        j = int(np.searchsorted(start_keys, key, side="right")) - 1
+        found = None
+        while j >= 0 and max_end_keys[j] >= key:
+            i = int(order[j])
+            end_line, end_col = self.all_premises.positions[start + i, 2:].tolist()
+            if ((end_line << 32) | end_col) >= key and (found is None or i < found):
+                found = i
+            j -= 1
+        return None if found is None else self.all_premises[start + found]
 
     def fill_cache(self) -> None:
+        """Precompute the accessibility bitmaps, end positions, and interval indexes of all files."""
+        premise_file_idxs = np.repeat(
+            np.arange(self.num_files),
+            [end - start for start, end in self.premise_ranges.values()],
+        )
+        all_start_keys, all_end_keys = _position_keys(self.all_premises.positions)
         for path in self.transitive_dep_graph.nodes:
-            self._get_imported_premises(path)
+            imported = self.transitive_dep_graph.row(path)[premise_file_idxs]
+            self.imported_premise_bitmaps[path] = np.packbits(imported)
+
+            start, end = self.premise_ranges[path]
+            end_keys = all_end_keys[start:end]
+            order = np.argsort(end_keys, kind="stable")
+            self.premise_end_keys[path] = (end_keys[order], order)
+            self.premise_intervals[path] = _interval_index(
+                all_start_keys[start:end], end_keys
+            )
 
     def _get_imported_premises(self, path: str) -> List[Premise]:
-        """Return a list of premises imported in file ``path``. The result is cached."""
-        premises = self.imported_premises_cache.get(path, None)
-        if premises is not None:
-            return premises
-
-        premises = []
-        for p in self.transitive_dep_graph.successors(path):
-            premises.extend(self._get_file(p).premises)
-        self.imported_premises_cache[path] = premises
-        return premises
+        """Return a list of premises imported in file ``path``."""
+        imported = np.unpackbits(
+            self.imported_premise_bitmaps[path], count=len(self.all_premises)
+        )
+        return [self.all_premises[i] for i in np.flatnonzero(imported)]
+
+    def _get_accessible_bitmap(self, path: str, pos: Pos) -> np.ndarray:
+        """Return an unpacked boolean bitmap of the premises accessible at ``pos`` in ``path``."""
+        mask = np.unpackbits(
+            self.imported_premise_bitmaps[path], count=len(self.all_premises)
+        ).view(bool)
+        end_keys, order = self.premise_end_keys[path]
+        num_before = np.searchsorted(end_keys, _pos_key(pos), side="right")
+        start, _ = self.premise_ranges[path]
+        mask[start + order[:num_before]] = True
+        return mask
 
     def get_accessible_premises(self, path: str, pos: Pos) -> PremiseSet:
         """Return the set of premises accessible at position ``pos`` in file ``path``,
         i.e., all premises defined in the (transitively) imported files or earlier in the same file.
         """
-        premises = PremiseSet()
-        for p in self.get_premises(path):
-            if p.end <= pos:
-                premises.add(p)
-        premises.update(self._get_imported_premises(path))
-        return premises
+        return _PremiseSubset(self, self._get_accessible_bitmap(path, pos))
 
     def get_accessible_premise_indexes(self, path: str, pos: Pos) -> List[int]:
-        return [
-            i
-            for i, p in enumerate(self.all_premises)
-            if (p.path == path and p.end <= pos)
-            or self.transitive_dep_graph.has_edge(path, p.path)
-        ]
+        return np.flatnonzero(self._get_accessible_bitmap(path, pos)).tolist()
+
+    def get_accessible_premise_mask(self, path: str, pos: Pos) -> torch.BoolTensor:
+        """Return a boolean mask over :attr:`all_premises` marking the premises
+        accessible at position ``pos`` in file ``path``.
+        """
+        return torch.from_numpy(self._get_accessible_bitmap(path, pos))
+
+    @property
+    def file_offsets(self) -> np.ndarray:
+        """Offsets of each file's premises in :attr:`all_premises` in topological order,
+        followed by the number of premises.
+        """
+        return self.all_premises.file_offsets
+
+    def get_imported_ranges(self, path: str) -> np.ndarray:
+        """Return the premises defined in the files imported by ``path`` as sorted, disjoint
+        half-open ranges of indexes in :attr:`all_premises`, in an array of shape ``(n, 2)``.
+
+        Premises are stored in topological file order, so consecutive imported files
+        (ignoring files without premises) form one contiguous range.
+        """
+        files = np.flatnonzero(self.transitive_dep_graph.row(path))
+        starts = self.file_offsets[files]
+        ends = self.file_offsets[files + 1]
+        nonempty = starts < ends
+        starts = starts[nonempty]
+        ends = ends[nonempty]
+        if len(starts) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        breaks = starts[1:] != ends[:-1]
+        return np.stack(
+            [starts[np.r_[True, breaks]], ends[np.r_[breaks, True]]], axis=1
+        )
+
+    def get_nearest_premises_sliced(
+        self,
+        premise_embeddings: torch.FloatTensor,
+        batch_context: List[Context],
+        batch_context_emb: torch.Tensor,
+        k: int,
+        premise_scales: Optional[torch.FloatTensor] = None,
+        max_fraction: float = 0.1,
+    ) -> Tuple[List[List[Premise]], List[List[float]]]:
+        """Same as :meth:`get_nearest_premises`, but only multiply the contexts with the
+        embeddings in :meth:`get_imported_ranges` and the premises of their own file,
+        instead of the entire corpus. Contexts in the same file are scored together.
+
+        Slicing saves work only when few premises are accessible, since products with a
+        single file's contexts are small; contexts whose files import more than
+        ``max_fraction`` of the corpus are searched by :meth:`get_nearest_premises` in one batch.
+        """
+        results = [None] * len(batch_context)
+        scores = [None] * len(batch_context)
+        path2ranges = {}
+        path2idxs = defaultdict(list)
+        full_idxs = []
+        for i, ctx in enumerate(batch_context):
+            if ctx.path not in path2ranges:
+                path2ranges[ctx.path] = self.get_imported_ranges(ctx.path)
+            ranges = path2ranges[ctx.path]
+            if (ranges[:, 1] - ranges[:, 0]).sum() > max_fraction * len(self):
+                full_idxs.append(i)
+            else:
+                path2idxs[ctx.path].append(i)
+
+        if full_idxs != []:
+            full_results, full_scores = self.get_nearest_premises(
+                premise_embeddings,
+                [batch_context[i] for i in full_idxs],
+                batch_context_emb[full_idxs],
+                k,
+                premise_scales,
+            )
+            for i, r, s in zip(full_idxs, full_results, full_scores):
+                results[i] = r
+                scores[i] = s
+
+        for path, idxs in path2idxs.items():
+            start, end = self.premise_ranges[path]
+            ranges = np.concatenate([path2ranges[path], [[start, end]]]).tolist()
+            similarities = torch.cat(
+                [
+                    score_premise_embeddings(
+                        batch_context_emb[idxs],
+                        premise_embeddings[s:e],
+                        premise_scales[s:e] if premise_scales is not None else None,
+                    )
+                    for s, e in ranges
+                ],
+                dim=1,
+            )
+
+            # Premises in the same file are accessible only if defined before the context.
+            end_keys, order = self.premise_end_keys[path]
+            own = np.zeros((len(idxs), end - start), dtype=bool)
+            for row, i in enumerate(idxs):
+                pos = batch_context[i].theorem_pos
+                own[row, order[: np.searchsorted(end_keys, _pos_key(pos), "right")]] = 1
+            num_imported = similarities.size(1) - (end - start)
+            similarities[:, num_imported:].masked_fill_(
+                ~torch.from_numpy(own).to(similarities.device), float("-inf")
+            )
+
+            for i, num_accessible in zip(
+                idxs, (num_imported + own.sum(axis=1)).tolist()
+            ):
+                if num_accessible < k:
+                    raise ValueError(
+                        f"Only {num_accessible} premises are accessible in {path}, "
+                        f"but {k} were requested."
+                    )
+
+            topk_scores, topk_cols = similarities.topk(k, dim=1)
+            # Map columns of `similarities` back to premise indexes.
+            ranges = np.array(ranges, dtype=np.int64)
+            col_ends = np.cumsum(ranges[:, 1] - ranges[:, 0])
+            cols = topk_cols.cpu().numpy()
+            which = np.searchsorted(col_ends, cols, side="right")
+            premise_idxs = ranges[which, 1] - (col_ends[which] - cols)
+
+            for i, p_idxs, s in zip(idxs, premise_idxs.tolist(), topk_scores.tolist()):
+                results[i] = [self.all_premises[j] for j in p_idxs]
+                scores[i] = s
+
+        return results, scores
 
     def get_nearest_premises(
         self,
@@ -302,29 +980,255 @@ class Corpus:
         batch_context: List[Context],
         batch_context_emb: torch.Tensor,
         k: int,
+        premise_scales: Optional[torch.FloatTensor] = None,
     ) -> Tuple[List[List[Premise]], List[List[float]]]:
-        """Perform a batch of nearest neighbour search."""
-        similarities = batch_context_emb @ premise_embeddings.t()
-        idxs_batch = similarities.argsort(dim=1, descending=True).tolist()
-        results = [[] for _ in batch_context]
-        scores = [[] for _ in batch_context]
-
-        for j, (ctx, idxs) in enumerate(zip(batch_context, idxs_batch)):
-            accessible_premises = self.get_accessible_premises(
-                ctx.path, ctx.theorem_pos
+        """Perform a batch of nearest neighbour search.
+
+        Inaccessible premises are masked out of the similarity matrix before a
+        single :func:`torch.topk`, so we never sort the entire corpus.
+        ``premise_embeddings`` may be quantized (see :func:`quantize_embeddings`).
+        """
+        similarities = score_premise_embeddings(
+            batch_context_emb, premise_embeddings, premise_scales
+        )
+        mask = torch.stack(
+            [
+                self.get_accessible_premise_mask(ctx.path, ctx.theorem_pos)
+                for ctx in batch_context
+            ]
+        ).to(similarities.device)
+
+        for ctx, num_accessible in zip(batch_context, mask.sum(dim=1).tolist()):
+            if num_accessible < k:
+                raise ValueError(
+                    f"Only {num_accessible} premises are accessible in {ctx.path}, "
+                    f"but {k} were requested."
+                )
+
+        similarities.masked_fill_(~mask, float("-inf"))
+        topk_scores, topk_idxs = similarities.topk(k, dim=1)
+        results = [[self.all_premises[i] for i in idxs] for idxs in topk_idxs.tolist()]
+        scores = topk_scores.tolist()
+        return results, scores
+
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize_embeddings(
+    embeddings: torch.Tensor, dtype: str
+) -> Tuple[torch.Tensor, Optional[torch.FloatTensor]]:
+    """Convert embeddings to the storage type ``dtype`` in :data:`EMBEDDING_DTYPES`.
+
+    Return the converted embeddings and, for int8, per-vector scales such that
+    ``embeddings[i] ~= values[i] * scales[i]`` (None otherwise).
+    """
+    assert dtype in EMBEDDING_DTYPES
+    if dtype != "int8":
+        return embeddings.to(getattr(torch, dtype)), None
+    embeddings = embeddings.to(torch.float32)
+    scales = embeddings.abs().amax(dim=1).clamp(min=1e-12) / 127
+    values = (embeddings / scales[:, None]).round().clamp(-127, 127).to(torch.int8)
+    return values, scales
+
+
+def dequantize_embeddings(
+    embeddings: torch.Tensor, scales: Optional[torch.FloatTensor] = None
+) -> torch.FloatTensor:
+    """Inverse of :func:`quantize_embeddings`, returning float32 embeddings."""
+    embeddings = embeddings.to(torch.float32)
+    if scales is not None:
+        embeddings *= scales.to(embeddings.device)[:, None]
+    return embeddings
+
+
+def score_premise_embeddings(
+    context_emb: torch.Tensor,
+    premise_embeddings: torch.Tensor,
+    premise_scales: Optional[torch.FloatTensor] = None,
+    chunk_size: int = 2048,
+) -> torch.Tensor:
+    """Return ``context_emb @ premise_embeddings.t()`` in the dtype of ``context_emb``.
+
+    Premise embeddings stored in another dtype (e.g., int8 or float16) are converted
+    ``chunk_size`` rows at a time, so the whole matrix is never held in the query dtype
+    and each converted chunk stays in cache.
+    """
+    if premise_embeddings.dtype == context_emb.dtype:
+        similarities = context_emb @ premise_embeddings.t()
+    else:
+        similarities = torch.cat(
+            [
+                context_emb
+                @ premise_embeddings[i : i + chunk_size].to(context_emb.dtype).t()
+                for i in range(0, len(premise_embeddings), chunk_size)
+            ],
+            dim=-1,
+        )
+    if premise_scales is not None:
+        similarities *= premise_scales.to(similarities.device, similarities.dtype)
+    return similarities
+
+
+class IVFIndex:
+    """An inverted-file (IVF) index for approximate nearest premise search.
+
+    Premise embeddings are clustered by spherical k-means. A query only scores the
+    premises in the ``nprobe`` clusters whose centroids are most similar to it, after
+    dropping the ones inaccessible from its context.
+    """
+
+    centroids: torch.FloatTensor
+    """Unit-norm cluster centroids of shape ``(nlist, embedding_size)``.
+    """
+
+    list_offsets: torch.LongTensor
+    """Cluster ``i`` consists of ``list_idxs[list_offsets[i] : list_offsets[i + 1]]``.
+    """
+
+    list_idxs: torch.LongTensor
+    """Premise indexes sorted by cluster.
+    """
+
+    def __init__(
+        self,
+        centroids: torch.FloatTensor,
+        list_offsets: torch.LongTensor,
+        list_idxs: torch.LongTensor,
+    ) -> None:
+        assert len(list_offsets) == len(centroids) + 1
+        assert list_offsets[-1] == len(list_idxs)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_idxs = list_idxs
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: torch.FloatTensor,
+        nlist: int,
+        num_iters: int = 10,
+        max_training_points: int = 256 * 1024,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """Cluster ``embeddings`` into ``nlist`` inverted lists with spherical k-means,
+        trained on at most ``max_training_points`` random embeddings. ``nlist`` is capped
+        at the number of embeddings.
+        """
+        if len(embeddings) == 0:
+            raise ValueError("Cannot build an IVF index without embeddings.")
+        nlist = min(nlist, len(embeddings))
+        embeddings = embeddings.to(torch.float32)
+        generator = torch.Generator().manual_seed(seed)
+        perm = torch.randperm(len(embeddings), generator=generator)
+        train = embeddings[perm[: max(nlist, max_training_points)]]
+        # ``train`` is a random permutation, so its first rows are distinct random points.
+        centroids = train[:nlist].clone()
+
+        for _ in range(num_iters):
+            assignment = (train @ centroids.t()).argmax(dim=1)
+            sums = torch.zeros_like(centroids).index_add_(0, assignment, train)
+            empty = torch.bincount(assignment, minlength=nlist) == 0
+            # Re-seed empty clusters with random training points.
+            sums[empty] = train[
+                torch.randint(len(train), (int(empty.sum()),), generator=generator)
+            ]
+            centroids = F.normalize(sums, dim=1)
+
+        assignment = torch.cat(
+            [
+                (embeddings[i : i + 65536] @ centroids.t()).argmax(dim=1)
+                for i in range(0, len(embeddings), 65536)
+            ]
+        )
+        list_idxs = assignment.argsort(stable=True)
+        list_offsets = torch.zeros(nlist + 1, dtype=torch.long)
+        list_offsets[1:] = torch.bincount(assignment, minlength=nlist).cumsum(dim=0)
+        return cls(centroids, list_offsets, list_idxs)
+
+    def search(
+        self,
+        corpus: "Corpus",
+        premise_embeddings: torch.FloatTensor,
+        batch_context: List[Context],
+        batch_context_emb: torch.Tensor,
+        k: int,
+        nprobe: int,
+        overfetch: float = 2.0,
+        premise_scales: Optional[torch.FloatTensor] = None,
+    ) -> Tuple[List[List[Premise]], List[List[float]]]:
+        """Approximate version of :meth:`Corpus.get_nearest_premises`.
+
+        For each context, the number of probed clusters is doubled starting from ``nprobe``
+        until they contain at least ``overfetch * k`` accessible premises (or all clusters
+        are probed), which compensates for candidates removed by the accessibility filter.
+        """
+        device = premise_embeddings.device
+        centroid_sims = (
+            batch_context_emb.to(torch.float32) @ self.centroids.to(device).t()
+        )
+        cluster_order = centroid_sims.argsort(dim=1, descending=True).cpu()
+        list_offsets = self.list_offsets.tolist()
+        results = []
+        scores = []
+
+        for ctx, ctx_emb, clusters in zip(
+            batch_context, batch_context_emb, cluster_order
+        ):
+            mask = corpus.get_accessible_premise_mask(ctx.path, ctx.theorem_pos)
+            num_probed = 0
+            probe = min(nprobe, self.nlist)
+            candidates = []
+            num_candidates = 0
+
+            while True:
+                for c in clusters[num_probed:probe].tolist():
+                    idxs = self.list_idxs[list_offsets[c] : list_offsets[c + 1]]
+                    idxs = idxs[mask[idxs]]
+                    candidates.append(idxs)
+                    num_candidates += len(idxs)
+                num_probed = probe
+                if num_candidates >= overfetch * k or probe == self.nlist:
+                    break
+                probe = min(2 * probe, self.nlist)
+
+            if num_candidates < k:
+                raise ValueError(
+                    f"Only {num_candidates} premises are accessible in {ctx.path}, "
+                    f"but {k} were requested."
+                )
+            candidates = torch.cat(candidates).to(device)
+            sims = score_premise_embeddings(
+                ctx_emb,
+                premise_embeddings[candidates],
+                premise_scales[candidates] if premise_scales is not None else None,
             )
-            for i in idxs:
-                p = self.all_premises[i]
-                if p in accessible_premises:
-                    results[j].append(p)
-                    scores[j].append(similarities[j, i].item())
-                    if len(results[j]) >= k:
-                        break
-            else:
-                raise ValueError
+            topk_scores, topk_pos = sims.topk(k)
+            results.append(
+                [corpus.all_premises[i] for i in candidates[topk_pos].tolist()]
+            )
+            scores.append(topk_scores.tolist())
 
         return results, scores
 
+    def save(self, dirname: str) -> None:
+        os.makedirs(dirname, exist_ok=True)
+        np.save(os.path.join(dirname, "centroids.npy"), self.centroids.numpy())
+        np.save(os.path.join(dirname, "list_offsets.npy"), self.list_offsets.numpy())
+        np.save(os.path.join(dirname, "list_idxs.npy"), self.list_idxs.numpy())
+
+    @classmethod
+    def load(cls, dirname: str) -> "IVFIndex":
+        centroids, list_offsets, list_idxs = [
+            torch.from_numpy(np.load(os.path.join(dirname, f"{name}.npy")))
+            for name in ("centroids", "list_offsets", "list_idxs")
+        ]
+        return cls(centroids, list_offsets, list_idxs)
+
 
 @dataclass(frozen=True)
 class IndexedCorpus:
@@ -333,9 +1237,139 @@ class IndexedCorpus:
     corpus: Corpus
     embeddings: torch.FloatTensor
 
+    premise_hashes: Optional[np.ndarray] = None
+    """Content hashes of the premises computed by :func:`hash_premises`,
+    used to reuse embeddings when re-indexing a changed corpus.
+    """
+
+    ann_index: Optional[IVFIndex] = None
+    """An optional approximate nearest neighbour index over :attr:`embeddings`.
+    """
+
+    embedding_scales: Optional[torch.FloatTensor] = None
+    """Per-vector scales of int8 :attr:`embeddings` (see :func:`quantize_embeddings`).
+    """
+
+    CORPUS_DIR = "corpus"
+    ANN_DIR = "ann"
+    EMBEDDINGS_FILE = "embeddings.npy"
+    HASHES_FILE = "premise_hashes.npy"
+    SCALES_FILE = "embedding_scales.npy"
+    MANIFEST_FILE = "manifest.json"
+
     def __post_init__(self):
         assert self.embeddings.device == torch.device("cpu")
         assert len(self.embeddings) == len(self.corpus)
+        assert self.premise_hashes is None or len(self.premise_hashes) == len(
+            self.corpus
+        )
+        assert (self.embeddings.dtype == torch.int8) == (
+            self.embedding_scales is not None
+        )
+
+    @classmethod
+    def is_indexed_dir(cls, path: str) -> bool:
+        """Check whether ``path`` is a directory written by ``retrieval/index.py --format directory``."""
+        return os.path.isfile(os.path.join(path, cls.MANIFEST_FILE))
+
+    @classmethod
+    def read_manifest(cls, dirname: str) -> Optional[Dict[str, Any]]:
+        """Return the manifest of an indexed corpus directory, or None if there is none."""
+        if not cls.is_indexed_dir(dirname):
+            return None
+        with open(os.path.join(dirname, cls.MANIFEST_FILE)) as inp:
+            return json.load(inp)
+
+    @classmethod
+    def write_manifest(cls, dirname: str, manifest: Dict[str, Any]) -> None:
+        """Atomically replace the manifest of an indexed corpus directory."""
+        path = os.path.join(dirname, cls.MANIFEST_FILE)
+        with open(path + ".tmp", "wt") as oup:
+            json.dump(manifest, oup)
+        os.replace(path + ".tmp", path)
+
+    def save(self, dirname: str) -> None:
+        """Write the indexed corpus to ``dirname`` in the format read by :meth:`load`,
+        e.g., to convert a pickled :class:`IndexedCorpus`.
+        """
+        os.makedirs(dirname, exist_ok=True)
+        self.corpus.save_snapshot(os.path.join(dirname, self.CORPUS_DIR))
+        embeddings = self.embeddings
+        if embeddings.dtype == torch.bfloat16:  # Not supported by NumPy.
+            embeddings = embeddings.to(torch.float32)
+        np.save(os.path.join(dirname, self.EMBEDDINGS_FILE), embeddings.numpy())
+        if self.premise_hashes is not None:
+            np.save(os.path.join(dirname, self.HASHES_FILE), self.premise_hashes)
+        if self.embedding_scales is not None:
+            np.save(
+                os.path.join(dirname, self.SCALES_FILE), self.embedding_scales.numpy()
+            )
+        if self.ann_index is not None:
+            self.ann_index.save(os.path.join(dirname, self.ANN_DIR))
+        self.write_manifest(
+            dirname,
+            {
+                "ckpt_path": None,
+                "ckpt_fingerprint": None,
+                "num_premises": len(self.corpus),
+                "embedding_size": embeddings.size(1),
+                "dtype": str(embeddings.numpy().dtype),
+                "shard_size": len(self.corpus),
+                "num_shards": 1,
+                "num_completed_shards": 1,
+            },
+        )
+
+    @classmethod
+    def load(cls, dirname: str) -> "IndexedCorpus":
+        """Open an indexed corpus directory without unpickling anything.
+
+        Embeddings are memory-mapped (copy-on-write) rather than read into memory, and
+        so are the premises (see :meth:`Corpus.load_snapshot`). Opening takes
+        milliseconds regardless of the corpus size, and processes opening the same
+        directory share its pages through the page cache.
+        """
+        manifest = cls.read_manifest(dirname)
+        if manifest is None:
+            raise ValueError(f"{dirname} is not an indexed corpus directory")
+        if manifest["num_completed_shards"] != manifest["num_shards"]:
+            raise ValueError(
+                f"Indexing of {dirname} is incomplete "
+                f"({manifest['num_completed_shards']}/{manifest['num_shards']} shards)"
+            )
+        corpus = Corpus.load_snapshot(os.path.join(dirname, cls.CORPUS_DIR))
+        embeddings = np.load(os.path.join(dirname, cls.EMBEDDINGS_FILE), mmap_mode="c")
+        hashes_path = os.path.join(dirname, cls.HASHES_FILE)
+        premise_hashes = np.load(hashes_path) if os.path.exists(hashes_path) else None
+        ann_dir = os.path.join(dirname, cls.ANN_DIR)
+        ann_index = IVFIndex.load(ann_dir) if os.path.isdir(ann_dir) else None
+        scales_path = os.path.join(dirname, cls.SCALES_FILE)
+        embedding_scales = (
+            torch.from_numpy(np.load(scales_path))
+            if os.path.exists(scales_path)
+            else None
+        )
+        return cls(
+            corpus,
+            torch.from_numpy(embeddings),
+            premise_hashes,
+            ann_index,
+            embedding_scales,
+        )
+
+
+def hash_premises(premises: List[Premise], salt: bytes) -> np.ndarray:
+    """Return a 16-byte hash of each premise's serialization, salted with ``salt``
+    (e.g., :meth:`PremiseRetriever.fingerprint`) so that hashes computed for different
+    encoders never match.
+    """
+    base = hashlib.blake2b(salt, digest_size=16)
+    hashes = []
+    for p in premises:
+        h = base.copy()
+        h.update(p.serialize().encode("utf-8"))
+        hashes.append(h.digest())
+    return np.array(hashes, dtype="S16")
 
 
 def get_all_pos_premises(annot_tac, corpus: Corpus) -> List[Premise]:
@@ -354,28 +1388,82 @@ def get_all_pos_premises(annot_tac, corpus: Corpus) -> List[Premise]:
     return list(all_pos_premises)
 
 
+def get_recall_and_mrr(
+    retrieved_premises: List[List[Premise]],
+    all_pos_premises: List[List[Premise]],
+    k: int,
+) -> Tuple[np.ndarray, float, int]:
+    """Evaluate retrieved premises against the ground truth premises of each example.
+
+    Return Recall@1..``k`` (in %), MRR, and the number of examples with at least one
+    ground truth premise, which are the only ones evaluated. Metrics are computed from a
+    boolean hit matrix whose entry ``(i, j)`` tells whether the ``j``-th premise retrieved
+    for example ``i`` is a new ground truth premise.
+    """
+    hits = []
+    num_pos = []
+    for premises, pos_premises in zip_strict(retrieved_premises, all_pos_premises):
+        pos_premises = set(pos_premises)
+        if len(pos_premises) == 0:
+            continue
+        row = np.zeros(k, dtype=bool)
+        seen = set()
+        for j, p in enumerate(premises[:k]):
+            if p in pos_premises and p not in seen:
+                row[j] = True
+                seen.add(p)
+        hits.append(row)
+        num_pos.append(len(pos_premises))
+
+    if hits == []:
+        return np.full(k, np.nan), np.nan, 0
+    hits = np.stack(hits)
+    recall = 100 * (hits.cumsum(axis=1) / np.array(num_pos)[:, None]).mean(axis=0)
+    first_hit = hits.argmax(axis=1)
+    MRR = np.where(hits.any(axis=1), 1.0 / (first_hit + 1), 0.0).mean()
+    return recall, MRR, len(hits)
+
+
 def format_augmented_state(
     s: str, premises: List[Premise], max_len: Optional[int] = None, p_drop: float = 0.0
 ) -> str:
-    """Format a state with retrieved premises and drop some of them with probability ``p_drop``."""
-    aug_s = ""
+    """Format a state with retrieved premises and drop some of them with probability ``p_drop``.
+
+    Premises are kept in order while they fit in ``max_len`` UTF-8 bytes together with the
+    state, and are then placed before the state in reverse order, each followed by a blank line.
+    """
     length = 0
     if max_len is None:
         max_len = 9999999999999999999999
-    max_premises_len = max_len - len(bytes(s.encode("utf-8")))
+    max_premises_len = max_len - len(s.encode("utf-8"))
+    kept = []
 
     for p in premises:
         if random.random() < p_drop:
             continue
-        p_str = f"{p.serialize()}\n\n"
-        l = len(bytes(p_str.encode("utf-8")))
+        l = p.serialized_nbytes() + 2  # The trailing "\n\n".
         if length + l > max_premises_len:
             continue
         length += l
-        aug_s = p_str + aug_s
+        kept.append(p.serialize())
+
+    kept.reverse()
+    kept.append(s)
+    return "\n\n".join(kept)
+
 
-    aug_s += s
-    return aug_s
+def format_augmented_states(
+    states: List[str],
+    premises: List[List[Premise]],
+    max_len: Optional[int] = None,
+    p_drop: float = 0.0,
+) -> List[str]:
+    """Apply :func:`format_augmented_state` to a batch of states and their retrieved premises."""
+    assert len(states) == len(premises)
+    return [
+        format_augmented_state(s, ps, max_len, p_drop)
+        for s, ps in zip(states, premises)
+    ]
 
 
 def get_optimizers(
@@ -425,6 +1513,54 @@ def load_checkpoint(model_cls, ckpt_path: str, device, freeze: bool):
     return model
 
 
+class LRUCache:
+    """A bounded mapping that evicts the least recently used entry and counts hits and misses.
+    A capacity of 0 disables caching.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        assert capacity >= 0
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value of ``key`` and mark it as recently used, or None on a miss."""
+        if self.capacity == 0:
+            return None
+        value = self.entries.get(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.capacity == 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all entries but keep the counters."""
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "capacity": self.capacity,
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
 def zip_strict(*args):
     assert len(args) > 1 and all(len(args[0]) == len(a) for a in args[1:])
     return zip(*args)
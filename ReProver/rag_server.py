@@ -1,12 +1,23 @@
 """
 Flask API server for RAG retrieval
 Run this alongside your Next.js app
+
+    python rag_server.py               # one process
+    python rag_server.py --workers 4   # pre-forked workers sharing the loaded index
+
+Each process serves requests with werkzeug's development server, one thread per
+request. It is not hardened for untrusted traffic; put it behind a reverse proxy.
 """
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from simple_rag import MathLibRAG
+from werkzeug.serving import make_server
+from simple_rag import MathLibRAG, RetrievalBatcher
 import os
+import signal
+import socket
+import argparse
+import torch
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for Next.js to call this
@@ -16,22 +27,51 @@ print("Initializing RAG system...")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CORPUS_PATH = os.path.join(BASE_DIR, "data/mathlib_corpus_minimal.jsonl")
 INDEX_PATH = os.path.join(BASE_DIR, "data/mathlib_index")
+# Concurrent requests are batched together; a batch size of 1 disables this
+MAX_BATCH_SIZE = int(os.environ.get("RAG_MAX_BATCH_SIZE", 32))
+MAX_BATCH_WAIT_MS = float(os.environ.get("RAG_MAX_BATCH_WAIT_MS", 2.0))
+# Number of batches encoded concurrently in each process, whatever the number of requests
+ENCODER_THREADS = int(os.environ.get("RAG_ENCODER_THREADS", 1))
+# Cached query embeddings and results (per process); a size of 0 disables caching
+CACHE_SIZE = int(os.environ.get("RAG_CACHE_SIZE", 1024))
+CACHE_TTL = float(os.environ["RAG_CACHE_TTL"]) if "RAG_CACHE_TTL" in os.environ else None
+# Maximum number of queries in one /retrieve_batch request
+MAX_BATCH_QUERIES = int(os.environ.get("RAG_MAX_BATCH_QUERIES", 256))
 
-rag = MathLibRAG(CORPUS_PATH)
+rag = MathLibRAG(None, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL)
 try:
-    rag.load_index(INDEX_PATH)
+    rag.load_index(INDEX_PATH, mmap=True)
     print("✅ RAG system loaded from pre-built index")
 except:
     print("Building index from scratch...")
+    rag.load_corpus(CORPUS_PATH)
     rag.build_index()
     rag.save_index(INDEX_PATH)
     print("✅ RAG system ready")
 
+# Started by each process that serves requests: threads do not survive fork()
+batcher = None
+
+
+def start_batcher():
+    global batcher
+    batcher = RetrievalBatcher(rag, max(1, MAX_BATCH_SIZE), MAX_BATCH_WAIT_MS, ENCODER_THREADS)
+
+
+def valid_k(k) -> bool:
+    """Whether k from a request body is a positive integer"""
+    return isinstance(k, int) and not isinstance(k, bool) and k > 0
+
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
-    return jsonify({"status": "ok", "corpus_size": len(rag.corpus)})
+    """Health check endpoint, with the cache statistics of the worker that answers"""
+    return jsonify({
+        "status": "ok",
+        "corpus_size": len(rag.corpus),
+        "pid": os.getpid(),
+        "cache": rag.cache_stats()
+    })
 
 
 @app.route('/retrieve', methods=['POST'])
@@ -64,11 +104,13 @@ def retrieve():
         query = data.get('query', '')
         k = data.get('k', 5)
 
-        if not query:
+        if not isinstance(query, str) or not query:
             return jsonify({"error": "Query is required"}), 400
+        if not valid_k(k):
+            return jsonify({"error": "k must be a positive integer"}), 400
 
-        # Retrieve theorems
-        results = rag.retrieve(query, k=k)
+        # Retrieve theorems, together with concurrent requests if batching is enabled
+        results = batcher.retrieve(query, k=k)
 
         # Format for prompt
         formatted = rag.format_for_prompt(results)
@@ -82,22 +124,133 @@ def retrieve():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/retrieve_batch', methods=['POST'])
+def retrieve_batch():
+    """
+    Retrieve relevant theorems for several queries in one call
+
+    Request body:
+    {
+        "queries": ["prove that addition is commutative", "divide both sides"],  // at most RAG_MAX_BATCH_QUERIES
+        "k": 5  // optional, default 5
+    }
+
+    Response:
+    {
+        "results": [
+            {
+                "results": [...],  // same as /retrieve, one entry per query
+                "formatted": "Available theorems from Mathlib:\n\n1. ..."
+            },
+            ...
+        ]
+    }
+    """
+    try:
+        data = request.json
+        queries = data.get('queries', [])
+        k = data.get('k', 5)
+
+        if (not isinstance(queries, list) or not queries
+                or not all(isinstance(query, str) and query for query in queries)):
+            return jsonify({"error": "Queries must be a non-empty list of non-empty strings"}), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries are allowed"}), 400
+        if not valid_k(k):
+            return jsonify({"error": "k must be a positive integer"}), 400
+
+        # Retrieve theorems for all queries, in batches of up to RAG_MAX_BATCH_SIZE
+        all_results = batcher.retrieve_batch(queries, k=k)
+
+        return jsonify({
+            "results": [
+                {"results": results, "formatted": rag.format_for_prompt(results)}
+                for results in all_results
+            ]
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/corpus', methods=['GET'])
 def get_corpus():
     """Get all theorems in corpus"""
     return jsonify({
-        "theorems": rag.corpus,
+        "theorems": list(rag.corpus),
         "count": len(rag.corpus)
     })
 
 
+def serve_prefork(host: str, port: int, num_workers: int):
+    """
+    Serve with num_workers forked processes accepting on one shared socket
+
+    The model, index and corpus are loaded above, before forking, so workers
+    share them copy-on-write (and the mmapped index through the page cache).
+    Each worker gets an equal share of the cores for the encoder. A worker
+    that exits is replaced until the server is stopped.
+    """
+    sock = socket.create_server((host, port), backlog=128)
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    workers = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                torch.set_num_threads(num_threads)
+                start_batcher()
+                make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+            finally:
+                os._exit(0)
+        workers.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(num_workers):
+        spawn()
+    signal.signal(signal.SIGTERM, stop)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except KeyboardInterrupt:  # Ctrl+C also reaches the workers
+            stopping = True
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, starting a new one")
+            spawn()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="RAG API server")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("RAG_WORKERS", 1)),
+                        help="Number of pre-forked worker processes")
+    args = parser.parse_args()
+
     print("\n" + "="*60)
     print("RAG API Server Starting")
     print("="*60)
-    print("Server will run on: http://localhost:5001")
-    print("Health check: http://localhost:5001/health")
-    print("Retrieve endpoint: POST http://localhost:5001/retrieve")
+    print(f"Server will run on: http://localhost:{args.port} ({args.workers} worker(s))")
+    print(f"Health check: http://localhost:{args.port}/health")
+    print(f"Retrieve endpoint: POST http://localhost:{args.port}/retrieve")
+    print(f"Batch endpoint: POST http://localhost:{args.port}/retrieve_batch")
     print("="*60 + "\n")
 
-    app.run(host='0.0.0.0', port=5001, debug=False)
+    if args.workers > 1:
+        serve_prefork(args.host, args.port, args.workers)
+    else:
+        start_batcher()
+        app.run(host=args.host, port=args.port, debug=False)
@@ -0,0 +1,28 @@
+"""Script for converting a pickled indexed corpus into the directory format.
+
+Pickles written by older versions of ``retrieval/index.py`` are accepted as well:
+their corpus is rebuilt in the current layout when unpickled (see ``Corpus.__setstate__``).
+"""
+
+import pickle
+import argparse
+from loguru import logger
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert a pickled IndexedCorpus into a memory-mappable directory."
+    )
+    parser.add_argument("--input-path", type=str, required=True)
+    parser.add_argument("--output-path", type=str, required=True)
+    args = parser.parse_args()
+    logger.info(args)
+
+    with open(args.input_path, "rb") as inp:
+        indexed_corpus = pickle.load(inp)
+    indexed_corpus.save(args.output_path)
+    logger.info(f"Indexed corpus saved to {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
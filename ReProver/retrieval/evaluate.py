@@ -0,0 +1,43 @@
+"""Script for evaluating the retrieval predictions saved by ``PremiseRetriever``
+(``predictions.pickle`` in the log directory of ``trainer.predict``).
+"""
+
+import pickle
+import argparse
+from loguru import logger
+
+from common import get_recall_and_mrr
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Script for evaluating the premise retriever."
+    )
+    parser.add_argument(
+        "--preds-file",
+        type=str,
+        required=True,
+        help="Path to the retriever's predictions file.",
+    )
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 10])
+    args = parser.parse_args()
+    logger.info(args)
+
+    with open(args.preds_file, "rb") as inp:
+        preds = pickle.load(inp)
+    recall, MRR, num_with_premises = get_recall_and_mrr(
+        [p["retrieved_premises"] for p in preds],
+        [p["all_pos_premises"] for p in preds],
+        max(args.k),
+    )
+
+    logger.info(
+        f"Evaluated {num_with_premises}/{len(preds)} tactics with ground truth premises"
+    )
+    logger.info(
+        ", ".join(f"R@{k} = {recall[k - 1]} %" for k in args.k) + f", MRR = {MRR}"
+    )
+
+
+if __name__ == "__main__":
+    main()
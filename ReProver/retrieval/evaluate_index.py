@@ -0,0 +1,151 @@
+"""Script for evaluating an indexed corpus on a split of the LeanDojo benchmark,
+reporting retrieval metrics together with latency and throughput.
+"""
+
+import os
+import json
+import time
+import torch
+import argparse
+import numpy as np
+from tqdm import tqdm
+from loguru import logger
+from lean_dojo import Pos
+from typing import Any, Dict, List, Tuple
+
+from common import Corpus, get_all_pos_premises, get_recall_and_mrr
+from retrieval.model import PremiseRetriever
+
+
+def load_examples(
+    data_path: str, split: str, corpus: Corpus
+) -> List[Tuple[Tuple[str, str, str, Pos], List[Any]]]:
+    """Return ``((state, file_name, theorem_full_name, theorem_pos), all_pos_premises)`` for
+    every traced tactic in ``{data_path}/{split}.json`` that uses at least one premise.
+    """
+    examples = []
+    for thm in json.load(open(os.path.join(data_path, f"{split}.json"))):
+        for tac in thm["traced_tactics"]:
+            all_pos_premises = get_all_pos_premises(tac["annotated_tactic"], corpus)
+            if all_pos_premises == []:
+                continue
+            query = (
+                tac["state_before"],
+                thm["file_path"],
+                thm["full_name"],
+                Pos(*thm["start"]),
+            )
+            examples.append((query, all_pos_premises))
+    return examples
+
+
+def evaluate(
+    model: PremiseRetriever,
+    examples: List[Tuple[Tuple[str, str, str, Pos], List[Any]]],
+    batch_size: int,
+    k: int,
+) -> Dict[str, Any]:
+    """Retrieve ``k`` premises for ``examples`` in batches, timing each batch."""
+    retrieved_premises = []
+    latencies = []
+    start = time.perf_counter()
+
+    for i in tqdm(range(0, len(examples), batch_size)):
+        queries = [query for query, _ in examples[i : i + batch_size]]
+        batch_start = time.perf_counter()
+        premises, _ = model.retrieve_batch(queries, k)
+        latencies.append(time.perf_counter() - batch_start)
+        retrieved_premises.extend(premises)
+
+    total_time = time.perf_counter() - start
+    recall, MRR, _ = get_recall_and_mrr(
+        retrieved_premises, [pos for _, pos in examples], k
+    )
+    return {
+        "recall": recall,
+        "MRR": MRR,
+        "latencies": np.array(latencies),
+        "throughput": len(examples) / total_time,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Script for evaluating an indexed corpus without training."
+    )
+    parser.add_argument("--ckpt_path", type=str, required=True)
+    parser.add_argument(
+        "--indexed-corpus-path",
+        type=str,
+        required=True,
+        help="An output of retrieval/index.py, in either format.",
+    )
+    parser.add_argument(
+        "--data-path",
+        type=str,
+        required=True,
+        help="A split of the benchmark, e.g., data/leandojo_benchmark_4/random/.",
+    )
+    parser.add_argument("--split", type=str, default="val")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 10])
+    parser.add_argument(
+        "--search",
+        type=str,
+        choices=["auto", "full", "sliced", "ann"],
+        default="auto",
+        help="How to search the premise embeddings (ann requires an IVF index).",
+    )
+    parser.add_argument("--ann-nlist", type=int, default=None)
+    parser.add_argument("--ann-nprobe", type=int, default=16)
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=os.cpu_count(),
+        help="Threads used by PyTorch on CPU.",
+    )
+    parser.add_argument("--max-examples", type=int, default=None)
+    args = parser.parse_args()
+    logger.info(args)
+
+    torch.set_num_threads(args.num_threads)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = PremiseRetriever.load_hf(args.ckpt_path, 2048, device)
+    # Caches would hide the cost of repeated queries.
+    model.set_cache_sizes(num_context_embeddings=0, num_results=0)
+
+    start = time.perf_counter()
+    model.load_corpus(args.indexed_corpus_path)
+    if model.embeddings_staled:
+        raise ValueError(f"{args.indexed_corpus_path} has no premise embeddings")
+    logger.info(f"Loaded the indexed corpus in {time.perf_counter() - start:.3f} s")
+
+    if args.search == "ann":
+        if args.ann_nlist is not None:
+            model.build_ann_index(args.ann_nlist, args.ann_nprobe)
+        elif model.ann_index is None:
+            raise ValueError("--search ann requires an IVF index or --ann-nlist")
+        model.ann_nprobe = args.ann_nprobe
+    else:
+        model.ann_index = None
+        model.sliced_search = {"auto": None, "full": False, "sliced": True}[args.search]
+
+    examples = load_examples(args.data_path, args.split, model.corpus)
+    if args.max_examples is not None:
+        examples = examples[: args.max_examples]
+    logger.info(f"Evaluating {len(examples)} tactics")
+
+    results = evaluate(model, examples, args.batch_size, max(args.k))
+    p50, p90, p99 = np.percentile(1000 * results["latencies"], [50, 90, 99])
+    logger.info(
+        ", ".join(f"R@{k} = {results['recall'][k - 1]} %" for k in args.k)
+        + f", MRR = {results['MRR']}"
+    )
+    logger.info(
+        f"Batch latency (ms): p50 = {p50:.1f}, p90 = {p90:.1f}, p99 = {p99:.1f}; "
+        f"throughput: {results['throughput']:.1f} tactics/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
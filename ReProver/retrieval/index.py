@@ -1,14 +1,326 @@
 """Script for indexing the corpus using the retriever.
 """
 
+import os
 import torch
 import pickle
+import shutil
 import argparse
+import tempfile
+import numpy as np
+from tqdm import tqdm
 from loguru import logger
+import multiprocessing as mp
+from contextlib import nullcontext
+from typing import List, Optional, Union
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from common import IndexedCorpus
+from common import (
+    Corpus,
+    Premise,
+    IndexedCorpus,
+    IVFIndex,
+    EMBEDDING_DTYPES,
+    hash_premises,
+    quantize_embeddings,
+    dequantize_embeddings,
+)
 from retrieval.model import PremiseRetriever
 
+_worker_model: Optional[PremiseRetriever] = None
+
+
+def _init_worker(
+    ckpt_path: str, max_seq_len: int, dtype: torch.dtype, num_threads: int
+) -> None:
+    global _worker_model
+    torch.set_num_threads(num_threads)
+    _worker_model = PremiseRetriever.load_hf(
+        ckpt_path, max_seq_len, torch.device("cpu"), dtype
+    )
+
+
+def _encode_batches(serialized: List[List[str]], output_path: str) -> str:
+    """Encode batches of serialized premises in a worker and save the embeddings to ``output_path``."""
+    embeddings = torch.cat(
+        [_worker_model.encode_serialized_premises(batch) for batch in serialized]
+    )
+    np.save(output_path, embeddings.to(torch.float32).numpy())
+    return output_path
+
+
+class ParallelPremiseEncoder:
+    """Encode premises on CPU with a pool of worker processes, each loading the encoder once.
+
+    Batches are planned by :meth:`PremiseRetriever.plan_premise_batches` in the parent
+    process, exactly as :meth:`PremiseRetriever.encode_premises` would, so every premise
+    is encoded with the same batch and padding as in a serial run. The embeddings are
+    identical to a serial run with the same number of threads as each worker; with other
+    thread counts, they may differ by floating-point rounding. Workers write their
+    embeddings to shard files, which are merged in the parent.
+    """
+
+    def __init__(
+        self,
+        model: PremiseRetriever,
+        ckpt_path: str,
+        num_workers: int,
+        threads_per_worker: int,
+        batches_per_task: int = 8,
+    ) -> None:
+        self.model = model
+        self.num_workers = num_workers
+        self.batches_per_task = batches_per_task
+        self.tmp_dir = tempfile.mkdtemp(prefix="reprover_index_")
+        self.executor = ProcessPoolExecutor(
+            num_workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(ckpt_path, model.max_seq_len, model.dtype, threads_per_worker),
+        )
+
+    def __enter__(self) -> "ParallelPremiseEncoder":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.executor.shutdown()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def encode_premises(
+        self,
+        premises: List[Premise],
+        batch_size: int,
+        progress: bool = True,
+        max_tokens_per_batch: Optional[int] = None,
+    ) -> torch.FloatTensor:
+        """Same as :meth:`PremiseRetriever.encode_premises` but returns float32 embeddings on CPU."""
+        batches = self.model.plan_premise_batches(
+            premises, batch_size, max_tokens_per_batch
+        )
+        embeddings = torch.zeros(
+            len(premises), self.model.embedding_size, dtype=torch.float32
+        )
+        futures = {}
+
+        for i in range(0, len(batches), self.batches_per_task):
+            task_batches = batches[i : i + self.batches_per_task]
+            task_serialized = [
+                [premises[j].serialize() for j in idxs] for idxs in task_batches
+            ]
+            output_path = os.path.join(self.tmp_dir, f"shard_{i}.npy")
+            future = self.executor.submit(_encode_batches, task_serialized, output_path)
+            futures[future] = task_batches
+
+        for future in tqdm(
+            as_completed(futures), total=len(futures), disable=not progress
+        ):
+            output_path = future.result()
+            idxs = [j for batch in futures[future] for j in batch]
+            embeddings[idxs] = torch.from_numpy(np.load(output_path))
+            os.remove(output_path)
+
+        return embeddings
+
+
+def load_indexed_corpus(path: str) -> IndexedCorpus:
+    """Load an indexed corpus written by this script in either format."""
+    if IndexedCorpus.is_indexed_dir(path):
+        return IndexedCorpus.load(path)
+    with open(path, "rb") as inp:
+        return pickle.load(inp)
+
+
+def find_reusable_embeddings(
+    premise_hashes: np.ndarray, previous: Optional[IndexedCorpus]
+) -> np.ndarray:
+    """Return for each hash the index of a premise with the same hash in ``previous``, or -1."""
+    if previous is None or previous.premise_hashes is None:
+        if previous is not None:
+            logger.warning("The previous index has no premise hashes to match against")
+        return np.full(len(premise_hashes), -1, dtype=np.int64)
+    lookup = {h: i for i, h in enumerate(previous.premise_hashes.tolist())}
+    return np.array(
+        [lookup.get(h, -1) for h in premise_hashes.tolist()], dtype=np.int64
+    )
+
+
+def encode_reusing(
+    model: PremiseRetriever,
+    encoder: Union[PremiseRetriever, ParallelPremiseEncoder],
+    premises: List[Premise],
+    reuse_idxs: np.ndarray,
+    previous: Optional[IndexedCorpus],
+    batch_size: int,
+    max_tokens_per_batch: Optional[int] = None,
+    progress: bool = True,
+) -> torch.FloatTensor:
+    """Return float32 embeddings of ``premises``, copying them from ``previous`` where
+    ``reuse_idxs`` is non-negative and encoding the rest with ``encoder``.
+    """
+    embeddings = torch.zeros(len(premises), model.embedding_size, dtype=torch.float32)
+
+    reused = np.flatnonzero(reuse_idxs >= 0)
+    if len(reused) > 0:
+        src = torch.from_numpy(reuse_idxs[reused])
+        embeddings[torch.from_numpy(reused)] = dequantize_embeddings(
+            previous.embeddings[src],
+            (
+                previous.embedding_scales[src]
+                if previous.embedding_scales is not None
+                else None
+            ),
+        )
+
+    todo = np.flatnonzero(reuse_idxs < 0)
+    if len(todo) > 0:
+        embeddings[torch.from_numpy(todo)] = (
+            encoder.encode_premises(
+                [premises[i] for i in todo],
+                batch_size,
+                progress=progress,
+                max_tokens_per_batch=max_tokens_per_batch,
+            )
+            .to(torch.float32)
+            .cpu()
+        )
+
+    return embeddings
+
+
+def check_resumable(
+    output_dir: str, corpus: Corpus, premise_hashes: np.ndarray
+) -> None:
+    """Raise an error unless the partial index in ``output_dir`` was started on the same
+    premises, i.e., with the same hashes (see :func:`hash_premises`) at the same positions.
+    """
+    hashes_path = os.path.join(output_dir, IndexedCorpus.HASHES_FILE)
+    if not os.path.exists(hashes_path) or not np.array_equal(
+        np.load(hashes_path), premise_hashes
+    ):
+        raise ValueError(
+            f"Cannot resume indexing in {output_dir}: the premises have changed. "
+            "Use a fresh output directory, with --previous-index to reuse embeddings."
+        )
+    saved = Corpus.load_snapshot(os.path.join(output_dir, IndexedCorpus.CORPUS_DIR))
+    if list(saved.all_premises.paths) != list(corpus.all_premises.paths) or not all(
+        np.array_equal(
+            getattr(saved.all_premises, name), getattr(corpus.all_premises, name)
+        )
+        for name in ("file_offsets", "positions")
+    ):
+        raise ValueError(
+            f"Cannot resume indexing in {output_dir}: the premises have moved. "
+            "Use a fresh output directory, with --previous-index to reuse embeddings."
+        )
+
+
+def index_to_directory(
+    model: PremiseRetriever,
+    encoder: Union[PremiseRetriever, ParallelPremiseEncoder],
+    ckpt_path: str,
+    output_dir: str,
+    batch_size: int,
+    shard_size: int,
+    dtype: str,
+    premise_hashes: np.ndarray,
+    reuse_idxs: np.ndarray,
+    previous: Optional[IndexedCorpus] = None,
+    max_tokens_per_batch: Optional[int] = None,
+    ann_nlist: Optional[int] = None,
+) -> None:
+    """Index ``model.corpus`` into ``output_dir`` shard by shard.
+
+    Embeddings are written into a memory-mapped ``.npy`` file, and the manifest is
+    updated after every shard, so an interrupted run resumes from the last completed shard.
+    Embeddings are stored as ``dtype`` (see :func:`quantize_embeddings`).
+    ``encoder`` is either ``model`` itself or a :class:`ParallelPremiseEncoder`.
+    Embeddings are copied from ``previous`` as in :func:`encode_reusing`. If ``ann_nlist``
+    is given, an :class:`IVFIndex` with that many clusters is built at the end.
+    """
+    corpus = model.corpus
+    num_shards = (len(corpus) + shard_size - 1) // shard_size
+    emb_path = os.path.join(output_dir, IndexedCorpus.EMBEDDINGS_FILE)
+    scales_path = os.path.join(output_dir, IndexedCorpus.SCALES_FILE)
+    manifest = IndexedCorpus.read_manifest(output_dir)
+    expected = {
+        "ckpt_path": ckpt_path,
+        "ckpt_fingerprint": model.fingerprint().hex(),
+        "num_premises": len(corpus),
+        "embedding_size": model.embedding_size,
+        "dtype": dtype,
+        "shard_size": shard_size,
+        "num_shards": num_shards,
+    }
+
+    if manifest is None:
+        os.makedirs(output_dir, exist_ok=True)
+        corpus.save_snapshot(os.path.join(output_dir, IndexedCorpus.CORPUS_DIR))
+        np.save(os.path.join(output_dir, IndexedCorpus.HASHES_FILE), premise_hashes)
+        embeddings = np.lib.format.open_memmap(
+            emb_path,
+            mode="w+",
+            dtype=dtype,
+            shape=(len(corpus), model.embedding_size),
+        )
+        scales = (
+            np.lib.format.open_memmap(
+                scales_path, mode="w+", dtype="float32", shape=(len(corpus),)
+            )
+            if dtype == "int8"
+            else None
+        )
+        manifest = {**expected, "num_completed_shards": 0}
+        IndexedCorpus.write_manifest(output_dir, manifest)
+    else:
+        for key, value in expected.items():
+            if manifest[key] != value:
+                raise ValueError(
+                    f"Cannot resume indexing in {output_dir}: {key} was {manifest[key]}, "
+                    f"but is now {value}. Use a fresh output directory."
+                )
+        check_resumable(output_dir, corpus, premise_hashes)
+        embeddings = np.lib.format.open_memmap(emb_path, mode="r+")
+        scales = (
+            np.lib.format.open_memmap(scales_path, mode="r+")
+            if dtype == "int8"
+            else None
+        )
+        logger.info(
+            f"Resuming from shard {manifest['num_completed_shards']}/{num_shards}"
+        )
+
+    for shard_idx in tqdm(range(manifest["num_completed_shards"], num_shards)):
+        start = shard_idx * shard_size
+        end = min(start + shard_size, len(corpus))
+        shard_embeddings = encode_reusing(
+            model,
+            encoder,
+            corpus.all_premises[start:end],
+            reuse_idxs[start:end],
+            previous,
+            batch_size,
+            max_tokens_per_batch,
+            progress=False,
+        )
+        shard_embeddings, shard_scales = quantize_embeddings(shard_embeddings, dtype)
+        embeddings[start:end] = shard_embeddings.numpy()
+        embeddings.flush()
+        if scales is not None:
+            scales[start:end] = shard_scales.numpy()
+            scales.flush()
+        manifest["num_completed_shards"] = shard_idx + 1
+        IndexedCorpus.write_manifest(output_dir, manifest)
+
+    if ann_nlist is not None:
+        logger.info(f"Building an IVF index with {ann_nlist} clusters")
+        IVFIndex.build(
+            dequantize_embeddings(
+                torch.from_numpy(np.asarray(embeddings)),
+                torch.from_numpy(np.asarray(scales)) if scales is not None else None,
+            ),
+            ann_nlist,
+        ).save(os.path.join(output_dir, IndexedCorpus.ANN_DIR))
+
 
 def main() -> None:
     parser = argparse.ArgumentParser(
@@ -22,22 +334,132 @@ def main() -> None:
         required=True,
     )
     parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument(
+        "--max-tokens-per-batch",
+        type=int,
+        default=None,
+        help="Batch premises by this token budget (including padding) instead of --batch-size.",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["pickle", "directory"],
+        default="pickle",
+        help="Pickle an IndexedCorpus, or write a resumable directory with memory-mapped embeddings.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=8192,
+        help="Number of premises per shard (--format directory only).",
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        choices=EMBEDDING_DTYPES,
+        default="float32",
+        help="Storage type of the embeddings. int8 embeddings are scaled per vector.",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="Encode on CPU with this many worker processes.",
+    )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="Intra-op threads of each worker (default: #CPUs / --num-workers).",
+    )
+    parser.add_argument(
+        "--previous-index",
+        type=str,
+        default=None,
+        help="An earlier output of this script. Embeddings of unchanged premises are reused.",
+    )
+    parser.add_argument(
+        "--ann-nlist",
+        type=int,
+        default=None,
+        help="Also build an IVF index with this many clusters for approximate search.",
+    )
     args = parser.parse_args()
     logger.info(args)
 
-    if not torch.cuda.is_available():
+    if args.num_workers > 1:
+        device = torch.device("cpu")
+    elif not torch.cuda.is_available():
         logger.warning("Indexing the corpus using CPU can be very slow.")
         device = torch.device("cpu")
     else:
         device = torch.device("cuda")
     model = PremiseRetriever.load_hf(args.ckpt_path, 2048, device)
     model.load_corpus(args.corpus_path)
-    model.reindex_corpus(batch_size=args.batch_size)
 
-    pickle.dump(
-        IndexedCorpus(model.corpus, model.corpus_embeddings.to(torch.float32).cpu()),
-        open(args.output_path, "wb"),
+    premise_hashes = hash_premises(model.corpus.all_premises, model.fingerprint())
+    previous = (
+        load_indexed_corpus(args.previous_index)
+        if args.previous_index is not None
+        else None
+    )
+    reuse_idxs = find_reusable_embeddings(premise_hashes, previous)
+    logger.info(
+        f"Reusing embeddings of {(reuse_idxs >= 0).sum()}/{len(reuse_idxs)} premises"
     )
+
+    if args.num_workers > 1:
+        threads_per_worker = args.threads_per_worker or max(
+            1, os.cpu_count() // args.num_workers
+        )
+        encoder = ParallelPremiseEncoder(
+            model, args.ckpt_path, args.num_workers, threads_per_worker
+        )
+    else:
+        encoder = nullcontext(model)
+
+    with encoder as encoder:
+        if args.format == "directory":
+            index_to_directory(
+                model,
+                encoder,
+                args.ckpt_path,
+                args.output_path,
+                args.batch_size,
+                args.shard_size,
+                args.dtype,
+                premise_hashes,
+                reuse_idxs,
+                previous,
+                args.max_tokens_per_batch,
+                args.ann_nlist,
+            )
+        else:
+            embeddings = encode_reusing(
+                model,
+                encoder,
+                model.corpus.all_premises,
+                reuse_idxs,
+                previous,
+                args.batch_size,
+                args.max_tokens_per_batch,
+            )
+            ann_index = (
+                IVFIndex.build(embeddings, args.ann_nlist)
+                if args.ann_nlist is not None
+                else None
+            )
+            embeddings, embedding_scales = quantize_embeddings(embeddings, args.dtype)
+            pickle.dump(
+                IndexedCorpus(
+                    model.corpus,
+                    embeddings,
+                    premise_hashes,
+                    ann_index,
+                    embedding_scales,
+                ),
+                open(args.output_path, "wb"),
+            )
     logger.info(f"Indexed corpus saved to {args.output_path}")
 
 
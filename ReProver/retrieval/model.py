@@ -2,6 +2,7 @@
 
 import os
 import torch
+import hashlib
 import pickle
 import numpy as np
 from tqdm import tqdm
@@ -9,14 +10,19 @@ from lean_dojo import Pos
 from loguru import logger
 import pytorch_lightning as pl
 import torch.nn.functional as F
-from typing import List, Dict, Any, Tuple, Union
+from typing import List, Dict, Any, Optional, Tuple, Union
 from transformers import AutoModelForTextEncoding, AutoTokenizer
 
 from common import (
     Premise,
     Context,
     Corpus,
+    IndexedCorpus,
+    IVFIndex,
+    LRUCache,
+    dequantize_embeddings,
     get_optimizers,
+    get_recall_and_mrr,
     load_checkpoint,
     zip_strict,
     cpu_checkpointing_enabled,
@@ -26,6 +32,36 @@ from common import (
 torch.set_float32_matmul_precision("medium")
 
 
+def _length_bucketed_batches(
+    lengths: np.ndarray, batch_size: int, max_tokens_per_batch: Optional[int]
+) -> List[List[int]]:
+    """Group indexes into ``lengths`` into batches of similar lengths, longest first.
+
+    A batch holds at most ``batch_size`` items, or, if ``max_tokens_per_batch`` is
+    given, at most that many tokens after padding to its longest item.
+    """
+    order = np.argsort(-lengths, kind="stable").tolist()
+    lengths = lengths.tolist()
+    batches = []
+    batch = []
+
+    for i in order:
+        if max_tokens_per_batch is None:
+            full = len(batch) >= batch_size
+        else:
+            # The first item of a batch is its longest one.
+            padded_len = lengths[batch[0]] if batch else lengths[i]
+            full = (len(batch) + 1) * padded_len > max_tokens_per_batch
+        if batch and full:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 class PremiseRetriever(pl.LightningModule):
     def __init__(
         self,
@@ -43,8 +79,80 @@ class PremiseRetriever(pl.LightningModule):
         self.max_seq_len = max_seq_len
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.encoder = AutoModelForTextEncoding.from_pretrained(model_name)
+        self.set_cache_sizes(num_context_embeddings=1024, num_results=0)
+        self.ann_index = None
+        self.ann_nprobe = 16
+        self.sliced_search = None
         self.embeddings_staled = True
 
+    @property
+    def embeddings_staled(self) -> bool:
+        return self._embeddings_staled
+
+    @embeddings_staled.setter
+    def embeddings_staled(self, staled: bool) -> None:
+        """Cached retrieval results and the ANN index go stale with the embeddings, and
+        so do cached context embeddings, since the encoder is the only thing that changes them.
+        """
+        if staled:
+            self.clear_caches()
+            self.ann_index = None
+        self._embeddings_staled = staled
+
+    # Cached retrieval results depend on how premises are searched, so changing any of
+    # the search settings below clears them.
+
+    @property
+    def ann_index(self) -> Optional[IVFIndex]:
+        """If not None, :meth:`retrieve_batch` searches this approximate index."""
+        return self._ann_index
+
+    @ann_index.setter
+    def ann_index(self, ann_index: Optional[IVFIndex]) -> None:
+        self.result_cache.clear()
+        self._ann_index = ann_index
+
+    @property
+    def ann_nprobe(self) -> int:
+        """Minimum number of clusters of :attr:`ann_index` probed per query."""
+        return self._ann_nprobe
+
+    @ann_nprobe.setter
+    def ann_nprobe(self, nprobe: int) -> None:
+        self.result_cache.clear()
+        self._ann_nprobe = nprobe
+
+    @property
+    def sliced_search(self) -> Optional[bool]:
+        """Whether exact search skips premises that are not imported
+        (None: only on CPU, see :meth:`retrieve_batch`).
+        """
+        return self._sliced_search
+
+    @sliced_search.setter
+    def sliced_search(self, sliced: Optional[bool]) -> None:
+        self.result_cache.clear()
+        self._sliced_search = sliced
+
+    def set_cache_sizes(self, num_context_embeddings: int, num_results: int) -> None:
+        """Set the capacities of the LRU caches used by :meth:`retrieve_batch`: one for
+        context embeddings keyed by serialized context, and one for retrieval results keyed
+        by ``(state, file_name, theorem_pos, k)``. A capacity of 0 disables a cache.
+        """
+        self.context_emb_cache = LRUCache(num_context_embeddings)
+        self.result_cache = LRUCache(num_results)
+
+    def clear_caches(self) -> None:
+        self.context_emb_cache.clear()
+        self.result_cache.clear()
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Return the sizes and hit/miss counters of the retrieval caches."""
+        return {
+            "context_embeddings": self.context_emb_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
+
     @classmethod
     def load(cls, ckpt_path: str, device, freeze: bool) -> "PremiseRetriever":
         return load_checkpoint(cls, ckpt_path, device, freeze)
@@ -67,9 +175,11 @@ class PremiseRetriever(pl.LightningModule):
 
     def load_corpus(self, path_or_corpus: Union[str, Corpus]) -> None:
         """Associate the retriever with a corpus."""
+        self.clear_caches()
         if isinstance(path_or_corpus, Corpus):
             self.corpus = path_or_corpus
             self.corpus_embeddings = None
+            self.corpus_embedding_scales = None
             self.embeddings_staled = True
             return
 
@@ -77,12 +187,39 @@ class PremiseRetriever(pl.LightningModule):
         if path.endswith(".jsonl"):  # A raw corpus without embeddings.
             self.corpus = Corpus(path)
             self.corpus_embeddings = None
+            self.corpus_embedding_scales = None
+            self.embeddings_staled = True
+        elif IndexedCorpus.is_indexed_dir(path):  # A directory with embeddings.
+            indexed_corpus = IndexedCorpus.load(path)
+            self.corpus = indexed_corpus.corpus
+            self.corpus_embeddings = indexed_corpus.embeddings
+            self.corpus_embedding_scales = indexed_corpus.embedding_scales
+            self.embeddings_staled = False
+            self.ann_index = indexed_corpus.ann_index
+        elif os.path.isdir(path):  # A corpus snapshot without embeddings.
+            self.corpus = Corpus.load_snapshot(path)
+            self.corpus_embeddings = None
+            self.corpus_embedding_scales = None
             self.embeddings_staled = True
         else:  # A corpus with pre-computed embeddings.
             indexed_corpus = pickle.load(open(path, "rb"))
             self.corpus = indexed_corpus.corpus
             self.corpus_embeddings = indexed_corpus.embeddings
+            self.corpus_embedding_scales = indexed_corpus.embedding_scales
             self.embeddings_staled = False
+            self.ann_index = indexed_corpus.ann_index
+
+    def fingerprint(self) -> bytes:
+        """Return a hash of everything that determines premise embeddings besides the
+        premises themselves: the encoder's weights (including their dtype) and ``max_seq_len``.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(self.max_seq_len).encode())
+        for name, param in self.encoder.state_dict().items():
+            h.update(name.encode())
+            h.update(str(param.dtype).encode())
+            h.update(param.detach().cpu().contiguous().view(torch.uint8).numpy())
+        return h.digest()
 
     @property
     def embedding_size(self) -> int:
@@ -150,6 +287,7 @@ class PremiseRetriever(pl.LightningModule):
 
         self.corpus = self.trainer.datamodule.corpus
         self.corpus_embeddings = None
+        self.corpus_embedding_scales = None
         self.embeddings_staled = True
 
     def training_step(self, batch: Dict[str, Any], _) -> torch.Tensor:
@@ -181,34 +319,99 @@ class PremiseRetriever(pl.LightningModule):
     ##############
 
     @torch.no_grad()
-    def reindex_corpus(self, batch_size: int) -> None:
-        """Re-index the retrieval corpus using the up-to-date encoder."""
-        if not self.embeddings_staled:
-            return
-        logger.info("Re-indexing the retrieval corpus")
-
-        self.corpus_embeddings = torch.zeros(
-            len(self.corpus.all_premises),
+    def encode_premises(
+        self,
+        premises: List[Premise],
+        batch_size: int,
+        progress: bool = True,
+        max_tokens_per_batch: Optional[int] = None,
+    ) -> torch.Tensor:
+        """Encode ``premises`` into a ``len(premises) x embedding_size`` tensor on ``device``.
+
+        Premises are encoded in order of decreasing tokenized length to minimize padding.
+        Batches contain ``batch_size`` premises, or, if ``max_tokens_per_batch`` is given,
+        as many premises as fit in that many tokens including padding.
+        """
+        embeddings = torch.zeros(
+            len(premises),
             self.embedding_size,
             dtype=self.encoder.dtype,
             device=self.device,
         )
+        batches = self.plan_premise_batches(premises, batch_size, max_tokens_per_batch)
 
-        for i in tqdm(range(0, len(self.corpus), batch_size)):
-            batch_premises = self.corpus.all_premises[i : i + batch_size]
-            tokenized_premises = self.tokenizer(
-                [p.serialize() for p in batch_premises],
-                padding="longest",
+        for idxs in tqdm(batches, disable=not progress):
+            embeddings[idxs] = self.encode_serialized_premises(
+                [premises[i].serialize() for i in idxs]
+            )
+
+        return embeddings
+
+    def plan_premise_batches(
+        self,
+        premises: List[Premise],
+        batch_size: int,
+        max_tokens_per_batch: Optional[int] = None,
+        chunk_size: int = 1024,
+    ) -> List[List[int]]:
+        """Group ``premises`` into batches for :meth:`encode_premises` by tokenized length
+        and return the indexes of the premises in each batch.
+
+        Premises are tokenized ``chunk_size`` at a time, keeping only their lengths, and
+        are tokenized again batch by batch when encoded.
+        """
+        lengths = np.zeros(len(premises), dtype=np.int64)
+        for i in range(0, len(premises), chunk_size):
+            input_ids = self.tokenizer(
+                [p.serialize() for p in premises[i : i + chunk_size]],
                 max_length=self.max_seq_len,
                 truncation=True,
-                return_tensors="pt",
-            ).to(self.device)
-            self.corpus_embeddings[i : i + batch_size] = self._encode(
-                tokenized_premises.input_ids, tokenized_premises.attention_mask
-            )
+            ).input_ids
+            lengths[i : i + len(input_ids)] = [len(ids) for ids in input_ids]
+        return _length_bucketed_batches(lengths, batch_size, max_tokens_per_batch)
+
+    @torch.no_grad()
+    def encode_serialized_premises(self, serialized: List[str]) -> torch.FloatTensor:
+        """Tokenize a batch of serialized premises, padded to the longest one, and encode them."""
+        tokenized = self.tokenizer(
+            serialized,
+            padding="longest",
+            max_length=self.max_seq_len,
+            truncation=True,
+            return_tensors="pt",
+        ).to(self.device)
+        return self._encode(tokenized.input_ids, tokenized.attention_mask)
+
+    @torch.no_grad()
+    def reindex_corpus(
+        self, batch_size: int, max_tokens_per_batch: Optional[int] = None
+    ) -> None:
+        """Re-index the retrieval corpus using the up-to-date encoder."""
+        if not self.embeddings_staled:
+            return
+        logger.info("Re-indexing the retrieval corpus")
 
+        self.corpus_embedding_scales = None
+        self.corpus_embeddings = self.encode_premises(
+            self.corpus.all_premises,
+            batch_size,
+            max_tokens_per_batch=max_tokens_per_batch,
+        )
         self.embeddings_staled = False
 
+    def build_ann_index(self, nlist: int, nprobe: int = 16) -> None:
+        """Build an IVF index over the corpus embeddings and use it in :meth:`retrieve_batch`,
+        probing at least ``nprobe`` of the ``nlist`` clusters per query.
+        """
+        assert not self.embeddings_staled
+        self.ann_index = IVFIndex.build(
+            dequantize_embeddings(
+                self.corpus_embeddings.cpu(), self.corpus_embedding_scales
+            ),
+            nlist,
+        )
+        self.ann_nprobe = nprobe
+
     def on_validation_start(self) -> None:
         self.reindex_corpus(self.trainer.datamodule.eval_batch_size)
 
@@ -225,30 +428,9 @@ class PremiseRetriever(pl.LightningModule):
         )
 
         # Evaluation & logging.
-        recall = [[] for _ in range(self.num_retrieved)]
-        MRR = []
-        num_with_premises = 0
-
-        for i, (all_pos_premises, premises) in enumerate(
-            zip_strict(batch["all_pos_premises"], retrieved_premises)
-        ):
-            all_pos_premises = set(all_pos_premises)
-            if len(all_pos_premises) == 0:
-                continue
-            else:
-                num_with_premises += 1
-            first_match_found = False
-
-            for j in range(self.num_retrieved):
-                TP = len(all_pos_premises.intersection(premises[: (j + 1)]))
-                recall[j].append(float(TP) / len(all_pos_premises))
-                if premises[j] in all_pos_premises and not first_match_found:
-                    MRR.append(1.0 / (j + 1))
-                    first_match_found = True
-            if not first_match_found:
-                MRR.append(0.0)
-
-        recall = [100 * np.mean(_) for _ in recall]
+        recall, MRR, num_with_premises = get_recall_and_mrr(
+            retrieved_premises, batch["all_pos_premises"], self.num_retrieved
+        )
 
         for j in range(self.num_retrieved):
             self.log(
@@ -261,7 +443,7 @@ class PremiseRetriever(pl.LightningModule):
 
         self.log(
             "MRR",
-            np.mean(MRR),
+            MRR,
             on_epoch=True,
             sync_dist=True,
             batch_size=num_with_premises,
@@ -274,6 +456,7 @@ class PremiseRetriever(pl.LightningModule):
     def on_predict_start(self) -> None:
         self.corpus = self.trainer.datamodule.corpus
         self.corpus_embeddings = None
+        self.corpus_embedding_scales = None
         self.embeddings_staled = True
         self.reindex_corpus(self.trainer.datamodule.eval_batch_size)
         self.predict_step_outputs = []
@@ -345,31 +528,114 @@ class PremiseRetriever(pl.LightningModule):
         k: int,
     ) -> Tuple[List[Premise], List[float]]:
         """Retrieve ``k`` premises from ``corpus`` using ``state`` and ``tactic_prefix`` as context."""
+        retrieved_premises, scores = self.retrieve_batch(
+            [(state, file_name, theorem_full_name, theorem_pos)], k
+        )
+        assert len(retrieved_premises) == len(scores) == 1
+        return retrieved_premises[0], scores[0]
+
+    @torch.no_grad()
+    def retrieve_batch(
+        self,
+        queries: List[Tuple[str, str, str, Pos]],
+        k: int,
+    ) -> Tuple[List[List[Premise]], List[List[float]]]:
+        """Retrieve ``k`` premises for each ``(state, file_name, theorem_full_name, theorem_pos)``
+        in ``queries``, encoding all contexts in one forward pass and searching them with one
+        matrix multiplication.
+        """
         self.reindex_corpus(batch_size=32)
 
-        ctx = Context(file_name, theorem_full_name, theorem_pos, state)
-        ctx_tokens = self.tokenizer(
-            [ctx.serialize()],
-            padding="longest",
-            max_length=self.max_seq_len,
-            truncation=True,
-            return_tensors="pt",
-        )
-        context_emb = self._encode(
-            ctx_tokens.input_ids.to(self.device),
-            ctx_tokens.attention_mask.to(self.device),
-        )
+        results = [
+            self.result_cache.get((state, file_name, tuple(theorem_pos), k))
+            for state, file_name, _, theorem_pos in queries
+        ]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing == []:
+            return [list(r[0]) for r in results], [list(r[1]) for r in results]
+
+        batch_context = [
+            Context(file_name, theorem_full_name, theorem_pos, state)
+            for state, file_name, theorem_full_name, theorem_pos in (
+                queries[i] for i in missing
+            )
+        ]
+        context_emb = self._encode_contexts(batch_context)
 
         if self.corpus_embeddings.device != context_emb.device:
             self.corpus_embeddings = self.corpus_embeddings.to(context_emb.device)
-        if self.corpus_embeddings.dtype != context_emb.dtype:
+            if self.corpus_embedding_scales is not None:
+                self.corpus_embedding_scales = self.corpus_embedding_scales.to(
+                    context_emb.device
+                )
+        # Convert floating-point embeddings only if it does not take more memory.
+        # Others are scored in their storage dtype by `score_premise_embeddings`.
+        if (
+            self.corpus_embeddings.is_floating_point()
+            and self.corpus_embeddings.dtype != context_emb.dtype
+            and context_emb.dtype.itemsize <= self.corpus_embeddings.dtype.itemsize
+        ):
             self.corpus_embeddings = self.corpus_embeddings.to(context_emb.dtype)
 
-        retrieved_premises, scores = self.corpus.get_nearest_premises(
-            self.corpus_embeddings,
-            [ctx],
-            context_emb,
-            k,
-        )
-        assert len(retrieved_premises) == len(scores) == 1
-        return retrieved_premises[0], scores[0]
+        if self.ann_index is None:
+            # Unless `sliced_search` says otherwise, skip premises that are not imported
+            # on CPU only. On GPU, one large matrix multiplication beats many small ones.
+            sliced = self.sliced_search
+            if sliced is None:
+                sliced = self.corpus_embeddings.device.type == "cpu"
+            search = (
+                self.corpus.get_nearest_premises_sliced
+                if sliced
+                else self.corpus.get_nearest_premises
+            )
+            retrieved_premises, scores = search(
+                self.corpus_embeddings,
+                batch_context,
+                context_emb,
+                k,
+                self.corpus_embedding_scales,
+            )
+        else:
+            retrieved_premises, scores = self.ann_index.search(
+                self.corpus,
+                self.corpus_embeddings,
+                batch_context,
+                context_emb,
+                k,
+                self.ann_nprobe,
+                premise_scales=self.corpus_embedding_scales,
+            )
+        for i, premises, s in zip_strict(missing, retrieved_premises, scores):
+            state, file_name, _, theorem_pos = queries[i]
+            results[i] = (premises, s)
+            self.result_cache.put(
+                (state, file_name, tuple(theorem_pos), k), (list(premises), list(s))
+            )
+
+        # Hand out copies so that callers cannot modify cached results.
+        return [list(r[0]) for r in results], [list(r[1]) for r in results]
+
+    def _encode_contexts(self, batch_context: List[Context]) -> torch.FloatTensor:
+        """Encode contexts in one forward pass, reusing cached embeddings where possible."""
+        keys = [ctx.serialize() for ctx in batch_context]
+        embs = [self.context_emb_cache.get(key) for key in keys]
+        missing = [i for i, emb in enumerate(embs) if emb is None]
+
+        if missing != []:
+            ctx_tokens = self.tokenizer(
+                [keys[i] for i in missing],
+                padding="longest",
+                max_length=self.max_seq_len,
+                truncation=True,
+                return_tensors="pt",
+            )
+            context_emb = self._encode(
+                ctx_tokens.input_ids.to(self.device),
+                ctx_tokens.attention_mask.to(self.device),
+            )
+            for i, emb in zip_strict(missing, context_emb):
+                embs[i] = emb
+                # Clone so that the cache does not keep the whole batch alive.
+                self.context_emb_cache.put(keys[i], emb.clone())
+
+        return torch.stack(embs)
@@ -3,37 +3,259 @@ Simple RAG system for Lean mathlib theorems - Hackathon version
 Uses sentence-transformers for fast embedding and FAISS for retrieval
 """
 
+import os
 import json
+import time
+import queue
 import pickle
+import threading
 import numpy as np
-from typing import List, Dict, Tuple
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, Iterable, List, Dict, Optional, Tuple
 from sentence_transformers import SentenceTransformer
 import faiss
 
 
+def normalize_query(query: str) -> str:
+    """Collapse whitespace, which the encoder's tokenizer ignores, so that resent queries share cache entries"""
+    return " ".join(query.split())
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with an optional time to live, counting hits and misses
+
+    A capacity of 0 disables caching.
+    """
+
+    def __init__(self, capacity: int, ttl: Optional[float] = None):
+        """
+        Args:
+            capacity: Maximum number of entries
+            ttl: Seconds after which an entry expires, or None to keep entries until evicted
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expiry time, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, usable: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+        """
+        Return the value of key and mark it as recently used, or None on a miss
+
+        A value for which usable() returns False is kept but counts as a miss.
+        """
+        if self.capacity == 0:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None or (usable is not None and not usable(entry[1])):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        if self.capacity == 0:
+            return
+        expiry = float("inf") if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.entries[key] = (expiry, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries but keep the counters"""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "capacity": self.capacity,
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+class TheoremTable(Sequence):
+    """
+    Read-only, columnar list of theorem dicts
+
+    Each field is stored as one UTF-8 buffer plus offsets, and a theorem dict is
+    only created when indexed, so a saved table can be memory-mapped and shared
+    between processes instead of being unpickled into Python objects. Fields whose
+    values are not all strings are stored JSON-encoded, and fields missing from some
+    theorems have a mask of the theorems that have them.
+    """
+
+    VERSION = 2
+
+    def __init__(self, fields: List[str], columns: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                 json_fields: List[str], present: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Args:
+            fields: Keys of the theorem dicts, in order
+            columns: Field -> (UTF-8 buffer, offsets of each theorem's value)
+            json_fields: Fields whose values are JSON-encoded
+            present: Field -> boolean mask of the theorems that have it, for fields
+                missing from some theorems
+        """
+        self.fields = fields
+        self.columns = columns
+        self.json_fields = set(json_fields)
+        self.present = present or {}
+        self.num_theorems = len(columns[fields[0]][1]) - 1 if fields else 0
+
+    @classmethod
+    def from_theorems(cls, theorems: Iterable[Dict]) -> "TheoremTable":
+        """Build a table from theorem dicts; keys missing from a theorem stay missing"""
+        absent = object()
+        fields = []
+        values = {}
+        num_theorems = 0
+        for theorem in theorems:
+            for field in theorem:
+                if field not in values:
+                    fields.append(field)
+                    values[field] = [absent] * num_theorems
+            for field in fields:
+                values[field].append(theorem.get(field, absent))
+            num_theorems += 1
+
+        columns = {}
+        json_fields = []
+        present = {}
+        for field in fields:
+            mask = np.array([v is not absent for v in values[field]], dtype=bool)
+            if not mask.all():
+                present[field] = mask
+            if all(isinstance(v, str) for v in values[field] if v is not absent):
+                encoded = [b"" if v is absent else v.encode('utf-8') for v in values[field]]
+            else:
+                encoded = [b"" if v is absent else json.dumps(v).encode('utf-8') for v in values[field]]
+                json_fields.append(field)
+            offsets = np.zeros(num_theorems + 1, dtype=np.int64)
+            np.cumsum([len(b) for b in encoded], out=offsets[1:])
+            columns[field] = (np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+        return cls(fields, columns, json_fields, present)
+
+    def __len__(self) -> int:
+        return self.num_theorems
+
+    def has(self, field: str, i: int) -> bool:
+        """Whether the i-th theorem has field"""
+        return field in self.columns and (field not in self.present or bool(self.present[field][i]))
+
+    def value(self, field: str, i: int) -> Any:
+        """Return the value of field in the i-th theorem, or None if it does not have it"""
+        if not self.has(field, i):
+            return None
+        buf, offsets = self.columns[field]
+        start, end = offsets[i:i + 2].tolist()
+        value = buf[start:end].tobytes().decode('utf-8')
+        return json.loads(value) if field in self.json_fields else value
+
+    def column(self, field: str) -> List[Any]:
+        """Return the values of field in all theorems"""
+        return [self.value(field, i) for i in range(len(self))]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return {field: self.value(field, idx) for field in self.fields if self.has(field, idx)}
+
+    def save(self, dirname: str):
+        """Save the table to dirname as *.npy arrays that load() can memory-map"""
+        os.makedirs(dirname, exist_ok=True)
+        for i, field in enumerate(self.fields):
+            buf, offsets = self.columns[field]
+            np.save(os.path.join(dirname, f"{i}.npy"), buf)
+            np.save(os.path.join(dirname, f"{i}.offsets.npy"), offsets)
+            if field in self.present:
+                np.save(os.path.join(dirname, f"{i}.present.npy"), self.present[field])
+        with open(os.path.join(dirname, "meta.json"), 'w') as f:
+            json.dump({
+                "version": self.VERSION,
+                "fields": self.fields,
+                "json_fields": sorted(self.json_fields),
+                "sparse_fields": [field for field in self.fields if field in self.present],
+                "num_theorems": len(self),
+            }, f)
+
+    @classmethod
+    def load(cls, dirname: str, mmap: bool = True) -> "TheoremTable":
+        """Load a table saved by save(), memory-mapping its arrays unless mmap is False"""
+        with open(os.path.join(dirname, "meta.json")) as f:
+            meta = json.load(f)
+        # Version 1 tables have no sparse fields
+        if meta["version"] not in (1, cls.VERSION):
+            raise ValueError(f"Unsupported theorem table version {meta['version']} in {dirname}")
+        mmap_mode = 'r' if mmap else None
+        # np.asarray() drops the np.memmap subclass, whose slicing is much slower
+        columns = {
+            field: (
+                np.asarray(np.load(os.path.join(dirname, f"{i}.npy"), mmap_mode=mmap_mode)),
+                np.asarray(np.load(os.path.join(dirname, f"{i}.offsets.npy"), mmap_mode=mmap_mode)),
+            )
+            for i, field in enumerate(meta["fields"])
+        }
+        sparse_fields = set(meta.get("sparse_fields", []))
+        present = {
+            field: np.asarray(np.load(os.path.join(dirname, f"{i}.present.npy"), mmap_mode=mmap_mode))
+            for i, field in enumerate(meta["fields"]) if field in sparse_fields
+        }
+        table = cls(meta["fields"], columns, meta["json_fields"], present)
+        assert len(table) == meta["num_theorems"]
+        return table
+
+
 class MathLibRAG:
-    def __init__(self, corpus_path: str, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self, corpus_path: Optional[str], model_name: str = "all-MiniLM-L6-v2",
+                 cache_size: int = 1024, cache_ttl: Optional[float] = None):
         """
         Initialize the RAG system
 
         Args:
-            corpus_path: Path to mathlib_corpus_minimal.jsonl
+            corpus_path: Path to mathlib_corpus_minimal.jsonl, or None to load the
+                corpus later with load_corpus() or load_index()
             model_name: SentenceTransformer model name
+            cache_size: Number of query embeddings and of results to cache (0 disables caching)
+            cache_ttl: Seconds after which cached entries expire, or None to keep them until evicted
         """
         print(f"Loading embedding model: {model_name}")
         self.model = SentenceTransformer(model_name)
-        self.corpus = []
+        self.corpus = TheoremTable.from_theorems([])
         self.index = None
+        # Normalized query -> embedding, and normalized query -> (k, top-k results)
+        self.embedding_cache = QueryCache(cache_size, cache_ttl)
+        self.result_cache = QueryCache(cache_size, cache_ttl)
 
-        print(f"Loading corpus from: {corpus_path}")
-        self.load_corpus(corpus_path)
+        if corpus_path is not None:
+            print(f"Loading corpus from: {corpus_path}")
+            self.load_corpus(corpus_path)
 
     def load_corpus(self, corpus_path: str):
         """Load theorems from jsonl file"""
         with open(corpus_path, 'r') as f:
-            for line in f:
-                theorem = json.loads(line)
-                self.corpus.append(theorem)
+            self.corpus = TheoremTable.from_theorems(json.loads(line) for line in f)
         print(f"Loaded {len(self.corpus)} theorems")
 
     def build_index(self):
@@ -41,7 +263,7 @@ class MathLibRAG:
         print("Building FAISS index...")
 
         # Create embeddings for all theorems
-        statements = [t['statement'] for t in self.corpus]
+        statements = self.corpus.column('statement')
         embeddings = self.model.encode(statements, show_progress_bar=True)
 
         # Normalize embeddings for cosine similarity
@@ -51,6 +273,7 @@ class MathLibRAG:
         dimension = embeddings.shape[1]
         self.index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
         self.index.add(embeddings.astype('float32'))
+        self.result_cache.clear()
 
         print(f"Index built with {self.index.ntotal} vectors")
 
@@ -65,24 +288,81 @@ class MathLibRAG:
         Returns:
             List of theorem dictionaries with scores
         """
+        return self.retrieve_batch([query], k=k)[0]
+
+    def retrieve_batch(self, queries: List[str], k: int = 5) -> List[List[Dict]]:
+        """
+        Retrieve top-k relevant theorems for several queries at once,
+        with one encoder call and one FAISS search for the queries not in the caches
+
+        Args:
+            queries: Natural language or Lean code queries
+            k: Number of results to return per query
+
+        Returns:
+            For each query, a list of theorem dictionaries with scores
+        """
         if self.index is None:
             raise ValueError("Index not built. Call build_index() first")
+        if not queries:
+            return []
 
-        # Embed query
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        keys = [normalize_query(query) for query in queries]
+        all_results = [self._cached_results(key, k) for key in keys]
+        # Distinct queries whose results are not cached
+        missing = list(dict.fromkeys(key for key, results in zip(keys, all_results) if results is None))
 
-        # Search
-        scores, indices = self.index.search(query_embedding.astype('float32'), k)
+        if missing:
+            # Embed queries, reusing cached embeddings
+            embeddings = {key: self.embedding_cache.get(key) for key in missing}
+            to_encode = [key for key, embedding in embeddings.items() if embedding is None]
+            if to_encode:
+                new_embeddings = self.model.encode(to_encode).astype('float32')
+                faiss.normalize_L2(new_embeddings)
+                for key, embedding in zip(to_encode, new_embeddings):
+                    embeddings[key] = embedding.copy()
+                    self.embedding_cache.put(key, embeddings[key])
 
-        # Prepare results
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            result = self.corpus[idx].copy()
-            result['score'] = float(score)
-            results.append(result)
+            # Search
+            query_embeddings = np.stack([embeddings[key] for key in missing])
+            scores, indices = self.index.search(query_embeddings, k)
 
-        return results
+            # Prepare results (FAISS pads with -1 when k exceeds the corpus size)
+            found = {}
+            for key, row_scores, row_indices in zip(missing, scores, indices):
+                results = []
+                for score, idx in zip(row_scores, row_indices):
+                    if idx < 0:
+                        continue
+                    result = self.corpus[idx]
+                    result['score'] = float(score)
+                    results.append(result)
+                self.result_cache.put(key, (k, results))
+                found[key] = results
+            all_results = [found[key] if results is None else results for key, results in zip(keys, all_results)]
+
+        # Cached results are shared, so hand out copies
+        return [[result.copy() for result in results[:k]] for results in all_results]
+
+    def _cached_results(self, key: str, k: int) -> Optional[List[Dict]]:
+        """
+        Cached results of a normalized query if they cover the top k
+
+        Results are cached under the query alone, retrieved with the largest k asked for
+        so far; the top k of a smaller k are a prefix of them.
+        """
+        # Fewer results than asked for means the whole corpus was retrieved
+        cached = self.result_cache.get(
+            key, lambda cached: cached[0] >= k or len(cached[1]) < cached[0]
+        )
+        return None if cached is None else cached[1]
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Sizes and hit rates of the query embedding and result caches"""
+        return {
+            "query_embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
 
     def format_for_prompt(self, results: List[Dict]) -> str:
         """Format retrieval results for K2-Think prompt"""
@@ -100,18 +380,115 @@ class MathLibRAG:
     def save_index(self, path: str):
         """Save index and corpus to disk"""
         faiss.write_index(self.index, f"{path}.index")
-        with open(f"{path}.corpus.pkl", 'wb') as f:
-            pickle.dump(self.corpus, f)
-        print(f"Index saved to {path}.index and {path}.corpus.pkl")
-
-    def load_index(self, path: str):
-        """Load pre-built index from disk"""
-        self.index = faiss.read_index(f"{path}.index")
-        with open(f"{path}.corpus.pkl", 'rb') as f:
-            self.corpus = pickle.load(f)
+        self.corpus.save(f"{path}.corpus")
+        print(f"Index saved to {path}.index and {path}.corpus")
+
+    def load_index(self, path: str, mmap: bool = False):
+        """
+        Load pre-built index from disk
+
+        Args:
+            path: Path prefix passed to save_index
+            mmap: Memory-map the index vectors and the corpus instead of reading them,
+                so that processes serving the same index share them through the page cache
+        """
+        flags = faiss.IO_FLAG_MMAP_IFC if mmap else 0
+        self.index = faiss.read_index(f"{path}.index", flags)
+        self.result_cache.clear()
+        if os.path.isdir(f"{path}.corpus"):
+            self.corpus = TheoremTable.load(f"{path}.corpus", mmap=mmap)
+        else:
+            # Saved before the columnar corpus; call save_index() again to convert it
+            with open(f"{path}.corpus.pkl", 'rb') as f:
+                self.corpus = TheoremTable.from_theorems(pickle.load(f))
         print(f"Index loaded: {self.index.ntotal} vectors")
 
 
+class RetrievalBatcher:
+    """
+    Dynamic batching in front of MathLibRAG.retrieve_batch
+
+    Concurrent retrieve() calls are queued; a bounded pool of background threads
+    collects them for up to max_wait_ms (or until max_batch_size requests are
+    waiting), retrieves them with one encoder call and one FAISS search, and
+    hands each caller its own results.
+    """
+
+    def __init__(self, rag: MathLibRAG, max_batch_size: int = 32, max_wait_ms: float = 2.0,
+                 num_workers: int = 1):
+        """
+        Args:
+            rag: The RAG system to batch requests for
+            max_batch_size: Maximum number of queries retrieved together
+            max_wait_ms: How long the first request of a batch waits for others
+            num_workers: Number of batches encoded concurrently
+        """
+        self.rag = rag
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.workers = [threading.Thread(target=self._run, daemon=True) for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def retrieve(self, query: str, k: int = 5) -> List[Dict]:
+        """Same as MathLibRAG.retrieve, batched with concurrent calls"""
+        if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            raise ValueError(f"k must be a positive integer, got {k!r}")
+        future = Future()
+        self.requests.put((query, k, future))
+        return future.result()
+
+    def retrieve_batch(self, queries: List[str], k: int = 5) -> List[List[Dict]]:
+        """Same as MathLibRAG.retrieve_batch, encoded by the same bounded pool of threads"""
+        if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            raise ValueError(f"k must be a positive integer, got {k!r}")
+        futures = [Future() for _ in queries]
+        for query, future in zip(queries, futures):
+            self.requests.put((query, k, future))
+        return [future.result() for future in futures]
+
+    def _next_batch(self) -> List[Tuple[str, int, Future]]:
+        """Block for one request, then collect more until the batch is full or the wait is over"""
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self.requests.get(timeout=timeout))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Nothing may escape this loop: later callers would wait for a dead worker forever.
+        while True:
+            batch = self._next_batch()
+            try:
+                self._retrieve(batch)
+            except Exception:
+                # Retrieve the requests one by one, so a bad one fails only its own caller
+                for request in batch:
+                    if request[2].done():
+                        continue
+                    try:
+                        self._retrieve([request])
+                    except Exception as e:
+                        request[2].set_exception(e)
+
+    def _retrieve(self, batch: List[Tuple[str, int, Future]]):
+        """Retrieve a batch with one call and set the result of each request"""
+        queries = [query for query, _, _ in batch]
+        # Top-k results are a prefix of the top-max_k results, so one search covers every k.
+        max_k = max(k for _, k, _ in batch)
+        all_results = self.rag.retrieve_batch(queries, k=max_k)
+        for (_, k, future), results in zip(batch, all_results):
+            future.set_result(results[:k])
+
+
 def test_rag():
     """Test the RAG system"""
     rag = MathLibRAG("/Users/nurmuhamed57/ax_hack_v1/ReProver/data/mathlib_corpus_minimal.jsonl")